@@ -84,10 +84,11 @@ module ForemanNutanix
         # Fetch VMs from shim server (now includes MAC and IP)
         base = ENV['NUTANIX_SHIM_SERVER_ADDR'] || 'http://localhost:8000'
         uri = URI("#{base.chomp('/')}/api/v1/vmm/list-vms")
+        uri.query = URI.encode_www_form(cluster_ext_id: @cluster)
         response = Net::HTTP.get_response(uri)
         data = JSON.parse(response.body)
 
-        # Filter VMs by cluster
+        # Filter VMs by cluster (the shim already filters, this guards older shims)
         filtered_data = data.select { |vm| vm['cluster_ext_id'] == @cluster }
 
         # Convert to NutanixCompute instances
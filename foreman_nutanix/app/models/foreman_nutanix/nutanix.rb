@@ -111,12 +111,14 @@ module ForemanNutanix
     def available_storage_containers
       Rails.logger.info '=== NUTANIX: Fetching available storage containers from shim server ==='
       base = ENV['NUTANIX_SHIM_SERVER_ADDR'] || 'http://localhost:8000'
+      cluster_ext_id = cluster
       uri = URI("#{base.chomp('/')}/api/v1/clustermgmt/list-storage-containers")
+      uri.query = URI.encode_www_form(cluster_ext_id: cluster_ext_id)
       response = Net::HTTP.get_response(uri)
       data = JSON.parse(response.body)
 
       # Filter storage containers by the cluster associated with this compute resource
-      cluster_ext_id = cluster
+      # (the shim already filters, this guards older shims)
       Rails.logger.info "=== NUTANIX: Storage containers - total: #{data.count}, cluster_ext_id: #{cluster_ext_id} ==="
       filtered_data = data.select { |container| container['cluster_ext_id'] == cluster_ext_id }
       Rails.logger.info "=== NUTANIX: Storage containers - filtered: #{filtered_data.count} ==="
@@ -160,12 +162,14 @@ module ForemanNutanix
     def available_images(_opts = {})
       Rails.logger.info '=== NUTANIX: Fetching available images from shim server ==='
       base = ENV['NUTANIX_SHIM_SERVER_ADDR'] || 'http://localhost:8000'
+      cluster_ext_id = cluster
       uri = URI("#{base.chomp('/')}/api/v1/vmm/list-images")
+      uri.query = URI.encode_www_form(cluster_ext_id: cluster_ext_id)
       response = Net::HTTP.get_response(uri)
       data = JSON.parse(response.body)
 
       # Filter images by cluster if cluster_location_ext_ids is available
-      cluster_ext_id = cluster
+      # (the shim already filters, this guards older shims)
       filtered_data = data.select do |image|
         # Include image if it's available on this cluster
         cluster_locations = image['cluster_location_ext_ids'] || []
@@ -0,0 +1,80 @@
+"""
+Benchmark the per-row cost of serializing list responses.
+
+Compares FastAPI's default handling of a route returning a list of response
+models (validation against `response_model`, then encoding) with returning
+a `FastJSONResponse` via `json_response`, for a listing of VMs.
+
+    uv run python benchmarks/serialization.py [--rows 10000] [--repeat 5]
+"""
+
+import argparse
+import datetime
+import time
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from nutanix_shim_server.responses import json_response
+from nutanix_shim_server.vmm import VmListMetadata
+
+
+def make_vms(n_rows: int) -> list[VmListMetadata]:
+    create_time = datetime.datetime(2025, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    return [
+        VmListMetadata(
+            ext_id=f"a1b2c3d4-e5f6-7890-abcd-{i:012d}",
+            name=f"vm-{i:05d}",
+            description="Benchmark VM",
+            cluster_ext_id="00061663-9fa0-28ca-185b-ac1f6b6f97e2",
+            power_state="ON",
+            num_sockets=2,
+            num_cores_per_socket=2,
+            memory_size_bytes=8589934592,
+            mac_address="50:6b:8d:12:34:56",
+            ip_addresses=["192.168.1.100"],
+            create_time=create_time,
+            disk_size_bytes=107374182400,
+        )
+        for i in range(n_rows)
+    ]
+
+
+def make_app(vms: list[VmListMetadata]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/default", response_model=list[VmListMetadata])
+    async def default() -> list[VmListMetadata]:
+        return vms
+
+    @app.get("/fast", response_model=list[VmListMetadata])
+    async def fast(response: Response):
+        return json_response(response, vms)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    client = TestClient(make_app(make_vms(args.rows)))
+    assert client.get("/default").json() == client.get("/fast").json()
+
+    for route in ("default", "fast"):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            client.get(f"/{route}")
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(
+            f"{route:>8}: {best * 1000:8.1f} ms per response, "
+            f"{best / args.rows * 1e6:6.2f} µs per row ({args.rows} rows)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import dataclasses
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable, TypeVar
+
+from nutanix_shim_server import metrics, server, tracing
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+@dataclasses.dataclass(frozen=True)
+class BulkheadStats:
+    """
+    Response model for the current load of a bulkhead.
+
+    Example:
+        {
+            "name": "listing",
+            "size": 10,
+            "active": 10,
+            "queued": 3,
+            "completed": 1234
+        }
+    """
+
+    name: str
+    size: int
+    active: int
+    queued: int
+    completed: int
+
+
+class Bulkhead:
+    """
+    Bounded thread pool running one class of blocking Nutanix calls.
+
+    Giving each class of operations (provisioning, listing, lookups) its own
+    pool means slow operations can only tie up the threads of their own
+    bulkhead, while the others keep serving. Calls beyond `size` queue up
+    in the bulkhead, see `stats()`, which are also exported as `metrics`.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self._executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix=f"bulkhead-{name}"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._active_gauge = metrics.BULKHEAD_ACTIVE.labels(name)
+        self._queued_gauge = metrics.BULKHEAD_QUEUED.labels(name)
+        self._wait_histogram = metrics.BULKHEAD_WAIT_SECONDS.labels(name)
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run `fn(*args, **kwargs)` on the bulkhead, awaiting its result.
+
+        Context variables of the caller are visible to `fn`. If the caller is
+        cancelled while the call is still queued, it is dropped.
+        """
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+        submitted_ns = time.time_ns()
+
+        def call() -> T:
+            self._wait_histogram.observe(time.perf_counter() - submitted)
+            context.run(tracing.add_span, "queue", submitted_ns, self.name)
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._publish()
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._publish()
+
+        with self._lock:
+            self._queued += 1
+            self._publish()
+        future = self._executor.submit(call)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if future.cancelled():
+                with self._lock:
+                    self._queued -= 1
+                    self._publish()
+
+    async def iterate(self, iterable: Iterable[T]) -> AsyncIterator[T]:
+        """Iterate over a blocking iterable, pulling each item on the bulkhead"""
+        iterator = iter(iterable)
+        try:
+            while (item := await self.run(next, iterator, _DONE)) is not _DONE:
+                yield item  # type: ignore
+        finally:
+            # ie stop the page fetches of `iter_pages` when the client goes away
+            if close := getattr(iterator, "close", None):
+                self._executor.submit(close)
+
+    def stats(self) -> BulkheadStats:
+        with self._lock:
+            return BulkheadStats(
+                name=self.name,
+                size=self.size,
+                active=self._active,
+                queued=self._queued,
+                completed=self._completed,
+            )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _publish(self) -> None:
+        """Update the gauges of the bulkhead, with `_lock` held"""
+        self._active_gauge.set(self._active)
+        self._queued_gauge.set(self._queued)
+
+
+class Bulkheads:
+    """
+    The bulkheads route handlers run their Nutanix calls on.
+
+    - provisioning: VM provisioning and bulk power actions, which take long
+    - listing: Inventory listings and other calls enumerating many entities
+    - lookup: Cheap calls on a single entity, ie VM details or power state
+    """
+
+    def __init__(self, ctx: server.Context):
+        sizes = ctx.nutanix_bulkhead_sizes
+        self.provisioning = Bulkhead("provisioning", sizes["provisioning"])
+        self.listing = Bulkhead("listing", sizes["listing"])
+        self.lookup = Bulkhead("lookup", sizes["lookup"])
+
+    def all(self) -> list[Bulkhead]:
+        return [self.provisioning, self.listing, self.lookup]
+
+    def close(self) -> None:
+        for bulkhead in self.all():
+            bulkhead.close()
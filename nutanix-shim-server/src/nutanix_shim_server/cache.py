@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+from nutanix_shim_server import metrics, server
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# (resource, loader args, sorted loader kwargs)
+CacheKey = tuple[str, tuple, tuple]
+
+
+@dataclasses.dataclass(frozen=True)
+class Cached(Generic[T]):
+    """A cached value and the wall-clock time it was loaded from Nutanix"""
+
+    value: T
+    fetched_at: float
+
+    @property
+    def age(self) -> float:
+        """Seconds since the value was loaded"""
+        return max(0.0, time.time() - self.fetched_at)
+
+
+class InventoryCache:
+    """
+    In-process cache for inventory listings (clusters, images, subnets, ...).
+
+    Each entry is keyed on a resource name plus the loader arguments, and the
+    resource name selects the TTL. Entries past their TTL are still served
+    immediately while a single background refresh per key reloads them
+    (stale-while-revalidate); only a missing entry makes the caller wait on
+    Nutanix. A resource with a TTL of zero or less is never cached.
+
+    The cache holds at most `max_entries` keys, evicting the least recently
+    used one beyond that.
+    """
+
+    def __init__(self, ctx: server.Context):
+        self.ttls = ctx.nutanix_cache_ttls
+        self.max_entries = ctx.nutanix_cache_max_entries
+        self._entries: OrderedDict[CacheKey, Cached] = OrderedDict()
+        self._refreshing: set[CacheKey] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="inventory-refresh"
+        )
+
+    def get(
+        self, resource: str, loader: Callable[..., T], *args, **kwargs
+    ) -> Cached[T]:
+        """
+        Return the cached result of `loader(*args, **kwargs)` for `resource`.
+
+        Parameters
+        ----------
+            resource: Name of the cached resource, selects the TTL
+            loader: Callable fetching the value from Nutanix
+            args, kwargs: Passed to `loader`, and part of the cache key
+
+        Returns
+        -------
+        Cached
+            with the value and when it was loaded
+        """
+        ttl = self.ttls.get(resource, 0)
+        if ttl <= 0:
+            metrics.CACHE_LOOKUPS.labels(resource, "uncached").inc()
+            return Cached(value=loader(*args, **kwargs), fetched_at=time.time())
+
+        key = (resource, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                if cached.age > ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._executor.submit(self._refresh, key, loader, args, kwargs)
+
+        if cached is not None:
+            result = "stale" if cached.age > ttl else "hit"
+            metrics.CACHE_LOOKUPS.labels(resource, result).inc()
+            return cached
+
+        metrics.CACHE_LOOKUPS.labels(resource, "miss").inc()
+        cached = Cached(value=loader(*args, **kwargs), fetched_at=time.time())
+        self._store(key, cached)
+        return cached
+
+    def invalidate(self, resource: None | str = None) -> None:
+        """Drop all entries, or only those of `resource`"""
+        with self._lock:
+            for key in list(self._entries):
+                if resource is None or key[0] == resource:
+                    del self._entries[key]
+
+    def dump(self) -> list[tuple[CacheKey, Cached]]:
+        """All entries, least recently used first"""
+        with self._lock:
+            return list(self._entries.items())
+
+    def load(self, entries: list[tuple[CacheKey, Cached]]) -> None:
+        """
+        Add entries, ie from a `dump` of a previous process.
+
+        Entries keep the time they were fetched at, so those past their TTL
+        are served stale and refreshed like any other. Entries of resources
+        which aren't cached (anymore) are skipped.
+        """
+        for key, cached in entries:
+            if self.ttls.get(key[0], 0) > 0:
+                self._store(key, cached)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _refresh(self, key: CacheKey, loader: Callable, args, kwargs) -> None:
+        try:
+            cached = Cached(value=loader(*args, **kwargs), fetched_at=time.time())
+        except Exception as e:
+            # Keep serving the stale entry, the next request retries the refresh
+            logger.warning(f"Background refresh of {key[0]} failed: {e}")
+        else:
+            self._store(key, cached)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: CacheKey, cached: Cached) -> None:
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class EtagCache:
+    """
+    Latest known ETag of each entity, keyed on its ext_id.
+
+    Nutanix requires the entity's current ETag (as `If-Match`) on every
+    mutation. Remembering the ETags of entities fetched anyway avoids a GET
+    before each mutation. An entity's ETag changes with each mutation, so the
+    caller drops it afterwards, and retries with a fresh one when a cached
+    ETag turns out to be stale. At most `max_entries` ETags are kept,
+    dropping the least recently used beyond that.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._etags: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ext_id: str) -> None | str:
+        with self._lock:
+            if (etag := self._etags.get(ext_id)) is not None:
+                self._etags.move_to_end(ext_id)
+            return etag
+
+    def put(self, ext_id: str, etag: None | str) -> None:
+        if etag is None:
+            return
+        with self._lock:
+            self._etags[ext_id] = etag
+            self._etags.move_to_end(ext_id)
+            while len(self._etags) > self.max_entries:
+                self._etags.popitem(last=False)
+
+    def discard(self, ext_id: str) -> None:
+        with self._lock:
+            self._etags.pop(ext_id, None)
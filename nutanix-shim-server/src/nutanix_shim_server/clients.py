@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, TypeVar
+
+import ntnx_clustermgmt_py_client as cm
+import ntnx_networking_py_client as net
+import ntnx_prism_py_client as prism
+import ntnx_vmm_py_client as vmm
+import urllib3
+
+from nutanix_shim_server import metrics, server, tracing
+
+logger = logging.getLogger(__name__)
+
+C = TypeVar("C")
+
+ACCEPT_ENCODING = "gzip, deflate, br"
+
+
+class NutanixClients:
+    """
+    Builds the SDK API clients of all Nutanix APIs used by the shim.
+
+    Every client is configured from the same `server.Context`, and all of
+    them send their requests through one shared urllib3 pool manager. The
+    APIs thus reuse the same keep-alive connections to Prism Central rather
+    than each SDK client opening, and TLS handshaking, its own.
+
+    The pool keeps up to `nutanix_connection_pool_size` connections per host.
+    Connections opened beyond that, when more threads make requests at the
+    same time, are closed after use and cost a new handshake next time, so
+    the size should cover the request handling threads plus the background
+    workers.
+
+    Every API call of the clients is recorded in `metrics`, with the retries
+    of its requests, and as a span of the request making it.
+    """
+
+    def __init__(self, ctx: server.Context):
+        self.ctx = ctx
+        self._pool_manager: None | urllib3.PoolManager = None
+        self._lock = threading.Lock()
+
+    def clustermgmt_client(self) -> cm.ApiClient:
+        return self._build(cm.Configuration(), cm.ApiClient)
+
+    def networking_client(self) -> net.ApiClient:
+        return self._build(net.Configuration(), net.ApiClient)
+
+    def prism_client(self) -> prism.ApiClient:
+        return self._build(prism.Configuration(), prism.ApiClient)
+
+    def vmm_client(self) -> vmm.ApiClient:
+        return self._build(vmm.Configuration(), vmm.ApiClient)
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        with self._lock:
+            if self._pool_manager is not None:
+                self._pool_manager.clear()
+
+    def _build(self, config, api_client: Callable[..., C]) -> C:
+        config.host = self.ctx.nutanix_host
+        config.scheme = self.ctx.nutanix_host_scheme
+        config.set_api_key(self.ctx.nutanix_api_key)
+        config.max_retry_attempts = 3
+        config.backoff_factor = 3
+        config.verify_ssl = self.ctx.nutanix_host_verify_ssl
+        config.port = self.ctx.nutanix_host_port
+        config.client_certificate_file = self.ctx.nutanix_client_certificate_file
+        config.root_ca_certificate_file = self.ctx.nutanix_root_ca_certificate_file
+        config.connection_pool_maxsize = self.ctx.nutanix_connection_pool_size
+
+        client = api_client(config)
+        client.add_default_header(  # type: ignore
+            header_name="Accept-Encoding", header_value=ACCEPT_ENCODING
+        )
+
+        _instrument(client)
+
+        # All SDKs build the same pool manager from the same configuration,
+        # keep the first one and have every later client use it as well
+        rest_client = client.rest_client  # type: ignore
+        with self._lock:
+            if self._pool_manager is None:
+                logger.info(
+                    "Sharing a connection pool of "
+                    f"{config.connection_pool_maxsize} connections per host"
+                )
+                self._pool_manager = rest_client.pool_manager
+            else:
+                rest_client.pool_manager = self._pool_manager
+        return client
+
+
+def _instrument(client) -> None:
+    """Record the API calls of an SDK client, and the retries of its requests"""
+    call_api = client._call_api
+    request = client.rest_client.request
+
+    def instrumented_call_api(resource_path, method, *args, **kwargs):
+        operation = f"{method} {resource_path}"
+        with metrics.upstream_call(operation), tracing.span("upstream", operation):
+            return call_api(resource_path, method, *args, **kwargs)
+
+    def instrumented_request(*args, **kwargs):
+        resp = request(*args, **kwargs)
+        if retries := getattr(resp.urllib3_response, "retries", None):
+            metrics.count_retries(len(retries.history))
+        return resp
+
+    client._call_api = instrumented_call_api
+    client.rest_client.request = instrumented_request
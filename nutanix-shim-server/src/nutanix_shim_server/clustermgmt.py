@@ -2,36 +2,43 @@ from __future__ import annotations
 
 import dataclasses
 import datetime
-from typing import Self, cast
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Self, cast
 
 import ntnx_clustermgmt_py_client as cm
 
-from nutanix_shim_server import server
-from nutanix_shim_server.utils import paginate
+from nutanix_shim_server import server, tracing
+from nutanix_shim_server.cache import InventoryCache
+from nutanix_shim_server.clients import NutanixClients
+from nutanix_shim_server.singleflight import single_flight
+from nutanix_shim_server.utils import (
+    iter_pages,
+    odata_filter,
+    odata_select,
+    odata_str,
+    paginate,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class ClusterMgmt:
-    config: cm.Configuration
-
-    def __init__(self, ctx: server.Context):
-        self.config = cm.Configuration()
-        self.config.host = ctx.nutanix_host
-        self.config.scheme = ctx.nutanix_host_scheme
-        self.config.set_api_key(ctx.nutanix_api_key)
-        self.config.max_retry_attempts = 3
-        self.config.backoff_factor = 3
-        self.config.verify_ssl = ctx.nutanix_host_verify_ssl
-        self.config.port = ctx.nutanix_host_port
-        self.config.client_certificate_file = ctx.nutanix_client_certificate_file
-        self.config.root_ca_certificate_file = ctx.nutanix_root_ca_certificate_file
+    def __init__(
+        self,
+        ctx: server.Context,
+        clients: None | NutanixClients = None,
+        cache: None | InventoryCache = None,
+    ):
+        self.clients = clients or NutanixClients(ctx)
+        self.cache = cache
+        self.cluster_stats_concurrency = ctx.nutanix_cluster_stats_concurrency
+        self.pagination_concurrency = ctx.nutanix_pagination_concurrency
 
     @property
     def client(self) -> cm.ApiClient:
         if not hasattr(self, "_client"):
-            self._client = cm.ApiClient(self.config)
-            self._client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+            self._client = self.clients.clustermgmt_client()
         return self._client
 
     @property
@@ -42,35 +49,139 @@ class ClusterMgmt:
             )
         return self._storage_containers_api
 
-    def list_storage_containers(self) -> list[StorageContainerMetadata]:
-        """Return list of storage containers"""
-        containers: list[cm.StorageContainer] = paginate(
-            self.storage_containers_api.list_storage_containers
-        )
+    @single_flight
+    def list_storage_containers(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> list[StorageContainerMetadata]:
+        """Return list of storage containers, optionally filtered"""
         return [
-            StorageContainerMetadata.from_nutanix_storage_container(container)
-            for container in containers
+            container
+            for page in self.iter_storage_containers(cluster_ext_id, name_prefix)
+            for container in page
         ]
 
+    def iter_storage_containers(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> Iterator[list[StorageContainerMetadata]]:
+        """Yield storage containers one converted page at a time"""
+        page: list[cm.StorageContainer]
+        for page in iter_pages(  # type: ignore
+            self.storage_containers_api.list_storage_containers,
+            concurrency=self.pagination_concurrency,
+            _filter=odata_filter(
+                cluster_ext_id and f"clusterExtId eq {odata_str(cluster_ext_id)}",
+                name_prefix and f"startswith(name, {odata_str(name_prefix)})",
+            ),
+        ):
+            with tracing.span("convert", "StorageContainerMetadata"):
+                containers = [
+                    StorageContainerMetadata.from_nutanix_storage_container(container)
+                    for container in page
+                ]
+            yield containers
+
     @property
     def clusters_api(self) -> cm.ClustersApi:
         if not hasattr(self, "_clusters_api"):
             self._clusters_api = cm.ClustersApi(api_client=self.client)
         return self._clusters_api
 
+    @single_flight
     def list_clusters(self) -> list[ClusterMetadata]:
         """Return list of clusters"""
-        clusters: list[cm.Cluster] = paginate(self.clusters_api.list_clusters)
-        return [ClusterMetadata.from_nutanix_cluster(cluster) for cluster in clusters]
+        clusters: list[cm.Cluster] = paginate(
+            self.clusters_api.list_clusters, concurrency=self.pagination_concurrency
+        )
+        with tracing.span("convert", "ClusterMetadata"):
+            return [
+                ClusterMetadata.from_nutanix_cluster(cluster) for cluster in clusters
+            ]
 
+    @single_flight
     def get_cluster_stats(self, cluster_ext_id: str) -> ClusterResourceStats:
         """Get resource usage statistics for a specific cluster
 
         Gets CPU/memory capacity by aggregating from cluster hosts, and usage
-        stats from the cluster stats API.
+        stats from the cluster stats API. Both are fetched concurrently, and
+        with an inventory cache the host capacity is served from it, so
+        usually only the stats are fetched live.
         """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            stats_future = executor.submit(
+                tracing.propagate(self._get_usage_stats), cluster_ext_id
+            )
+            if self.cache is not None:
+                capacity = self.cache.get(
+                    "host_capacity", self.get_host_capacity, cluster_ext_id
+                ).value
+            else:
+                capacity = self.get_host_capacity(cluster_ext_id)
+            stats = stats_future.result()
+
+        with tracing.span("convert", "ClusterResourceStats"):
+            return ClusterResourceStats.from_nutanix_cluster_stats(
+                stats,
+                capacity.cpu_capacity_hz,
+                capacity.memory_capacity_bytes,
+                capacity.cpu_cores,
+            )
 
-        # Get cluster stats for usage metrics
+    def get_clusters_stats(
+        self, cluster_ext_ids: None | list[str] = None
+    ) -> list[ClusterStatsResult]:
+        """
+        Get resource usage statistics for many clusters at once.
+
+        The clusters are queried concurrently, at most
+        `cluster_stats_concurrency` at a time. A cluster whose stats can't be
+        fetched gets its error rather than failing the others.
+
+        Parameters
+        ----------
+            cluster_ext_ids: The clusters to query, all clusters if None
+
+        Returns
+        -------
+        list[ClusterStatsResult]
+            with the stats or error of each cluster
+        """
+        if cluster_ext_ids is None:
+            if self.cache is not None:
+                clusters = self.cache.get("clusters", self.list_clusters).value
+            else:
+                clusters = self.list_clusters()
+            cluster_ext_ids = [cluster.ext_id for cluster in clusters]
+        cluster_ext_ids = list(dict.fromkeys(cluster_ext_ids))
+        if not cluster_ext_ids:
+            return []
+
+        results = []
+        with ThreadPoolExecutor(
+            max_workers=min(len(cluster_ext_ids), self.cluster_stats_concurrency),
+            thread_name_prefix="cluster-stats",
+        ) as executor:
+            futures = [
+                executor.submit(
+                    tracing.propagate(self.get_cluster_stats), cluster_ext_id
+                )
+                for cluster_ext_id in cluster_ext_ids
+            ]
+            for cluster_ext_id, future in zip(cluster_ext_ids, futures):
+                try:
+                    results.append(
+                        ClusterStatsResult(ext_id=cluster_ext_id, stats=future.result())
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Failed to get stats of cluster {cluster_ext_id}: {e}"
+                    )
+                    results.append(
+                        ClusterStatsResult(ext_id=cluster_ext_id, error=str(e))
+                    )
+        return results
+
+    def _get_usage_stats(self, cluster_ext_id: str) -> cm.ClusterStats:
+        """Get the cluster's usage stats over the last hour"""
         end_time = datetime.datetime.now(datetime.timezone.utc)
         start_time = end_time - datetime.timedelta(hours=1)
 
@@ -79,38 +190,19 @@ class ClusterMgmt:
             _startTime=start_time,
             _endTime=end_time,
         )
-        stats: cm.ClusterStats = stats_resp.data  # type: ignore
+        return stats_resp.data  # type: ignore
 
-        # Get hosts to aggregate CPU and memory capacity
+    @single_flight
+    def get_host_capacity(self, cluster_ext_id: str) -> HostCapacity:
+        """Aggregate the CPU and memory capacity of the cluster's hosts"""
         hosts: list[cm.Host] = paginate(
-            self.clusters_api.list_hosts_by_cluster_id, clusterExtId=cluster_ext_id
-        )
-
-        # Aggregate capacity from all hosts in the cluster
-        total_cpu_capacity_hz = 0
-        total_memory_capacity_bytes = 0
-        total_cpu_cores = 0
-
-        if hosts:
-            for host in hosts:
-                # Try cpu_capacity_hz first, fall back to calculating from frequency and cores
-                if host.cpu_capacity_hz:
-                    total_cpu_capacity_hz += host.cpu_capacity_hz
-                elif host.cpu_frequency_hz and host.number_of_cpu_cores:
-                    # Calculate capacity: frequency * number of cores
-                    total_cpu_capacity_hz += (
-                        host.cpu_frequency_hz * host.number_of_cpu_cores
-                    )
-
-                if host.memory_size_bytes:
-                    total_memory_capacity_bytes += host.memory_size_bytes
-
-                if host.number_of_cpu_cores:
-                    total_cpu_cores += host.number_of_cpu_cores
-
-        return ClusterResourceStats.from_nutanix_cluster_stats(
-            stats, total_cpu_capacity_hz, total_memory_capacity_bytes, total_cpu_cores
+            self.clusters_api.list_hosts_by_cluster_id,
+            concurrency=self.pagination_concurrency,
+            clusterExtId=cluster_ext_id,
+            _select=HostCapacity.select(),
         )
+        with tracing.span("convert", "HostCapacity"):
+            return HostCapacity.from_nutanix_hosts(hosts)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -175,6 +267,59 @@ class StorageContainerMetadata:
         )
 
 
+@dataclasses.dataclass(frozen=True)
+class HostCapacity:
+    """
+    CPU and memory capacity of a cluster, aggregated from its hosts.
+
+    Host hardware rarely changes, so this is cached much longer than the
+    cluster's usage stats.
+    """
+
+    cpu_capacity_hz: int
+    memory_capacity_bytes: int
+    cpu_cores: int
+
+    @classmethod
+    def select(cls) -> str:
+        """The `$select` for hosts, with only the properties aggregated"""
+        return odata_select(
+            cls,
+            # Computed from the frequency and cores if the capacity is missing
+            cpu_capacity_hz=("cpuCapacityHz", "cpuFrequencyHz", "numberOfCpuCores"),
+            memory_capacity_bytes="memorySizeBytes",
+            cpu_cores="numberOfCpuCores",
+        )
+
+    @classmethod
+    def from_nutanix_hosts(cls, hosts: list[cm.Host]) -> Self:
+        total_cpu_capacity_hz = 0
+        total_memory_capacity_bytes = 0
+        total_cpu_cores = 0
+
+        for host in hosts:
+            # Try cpu_capacity_hz first, fall back to calculating from frequency and cores
+            if host.cpu_capacity_hz:
+                total_cpu_capacity_hz += host.cpu_capacity_hz
+            elif host.cpu_frequency_hz and host.number_of_cpu_cores:
+                # Calculate capacity: frequency * number of cores
+                total_cpu_capacity_hz += (
+                    host.cpu_frequency_hz * host.number_of_cpu_cores
+                )
+
+            if host.memory_size_bytes:
+                total_memory_capacity_bytes += host.memory_size_bytes
+
+            if host.number_of_cpu_cores:
+                total_cpu_cores += host.number_of_cpu_cores
+
+        return cls(
+            cpu_capacity_hz=total_cpu_capacity_hz,
+            memory_capacity_bytes=total_memory_capacity_bytes,
+            cpu_cores=total_cpu_cores,
+        )
+
+
 @dataclasses.dataclass(frozen=True)
 class ClusterResourceStats:
     """
@@ -292,6 +437,19 @@ class ClusterResourceStats:
         )
 
 
+@dataclasses.dataclass(frozen=True)
+class ClusterStatsResult:
+    """
+    Response model for the stats of one cluster of a fleet-wide request.
+
+    Exactly one of `stats` (on success) and `error` (on failure) is set.
+    """
+
+    ext_id: str
+    stats: None | ClusterResourceStats = None
+    error: None | str = None
+
+
 if __name__ == "__main__":
     mgmt = ClusterMgmt()
     mgmt.list_clusters()
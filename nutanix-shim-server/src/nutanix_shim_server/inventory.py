@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import threading
+import time
+from typing import Callable, Generic, TypeVar
+
+from nutanix_shim_server import server
+from nutanix_shim_server.cache import Cached
+from nutanix_shim_server.networking import Networking, SubnetMetadata
+from nutanix_shim_server.vmm import ImageMetadata, VirtualMachineMgmt, VmListMetadata
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Delta queries reach back this much further than the previous sync, so
+# changes aren't missed when the clocks of the shim and Prism Central differ
+CLOCK_SKEW = datetime.timedelta(seconds=60)
+
+# (changed or new entities, ext_ids of removed entities)
+Changes = tuple[list[T], set[str]]
+
+
+class _Collection(Generic[T]):
+    """
+    The synced entities of one kind, keyed on their ext_id.
+
+    `load` fetches all entities. `changes`, if given, fetches only what changed
+    since a point in time, which is used between full loads. Entities removed
+    without `changes` reporting it are dropped by the next full load.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], list[T]],
+        changes: None | Callable[[datetime.datetime], Changes[T]] = None,
+    ):
+        self.name = name
+        self.load = load
+        self.changes = changes
+        self.entities: dict[str, T] = {}
+        self.fetched_at: None | float = None
+        self._synced_at: None | datetime.datetime = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> None | Cached[list[T]]:
+        """All entities and when they were last synced, None until loaded"""
+        with self._lock:
+            if self.fetched_at is None:
+                return None
+            return Cached(
+                value=list(self.entities.values()), fetched_at=self.fetched_at
+            )
+
+    def restore(self, snapshot: Cached[list[T]]) -> None:
+        """
+        Serve `snapshot` until loaded, ie the entities from before a restart.
+
+        The next sync loads all entities, as changes since the snapshot can't
+        tell about removed ones.
+        """
+        with self._lock:
+            if self.fetched_at is None:
+                self.entities = {e.ext_id: e for e in snapshot.value}  # type: ignore
+                self.fetched_at = snapshot.fetched_at
+
+    def sync(self, reload_interval: float) -> None:
+        """Load all entities, or only the changes if loaded recently enough"""
+        started = datetime.datetime.now(datetime.timezone.utc)
+        fetched_at = time.time()
+        full = (
+            self._synced_at is None
+            or self.changes is None
+            or time.monotonic() - self._loaded_at >= reload_interval
+        )
+        if full:
+            entities = {entity.ext_id: entity for entity in self.load()}  # type: ignore
+            with self._lock:
+                self.entities = entities
+                self.fetched_at = fetched_at
+            self._loaded_at = time.monotonic()
+            logger.info(f"Loaded {len(entities)} {self.name} into the inventory")
+        else:
+            changed, removed = self.changes(self._synced_at - CLOCK_SKEW)  # type: ignore
+            with self._lock:
+                for ext_id in removed:
+                    self.entities.pop(ext_id, None)
+                for entity in changed:
+                    self.entities[entity.ext_id] = entity  # type: ignore
+                self.fetched_at = fetched_at
+            if changed or removed:
+                logger.info(
+                    f"Synced {len(changed)} changed and {len(removed)} removed "
+                    f"{self.name} into the inventory"
+                )
+        self._synced_at = started
+
+
+class Inventory:
+    """
+    In-memory inventory of VMs, images and subnets, synced in the background.
+
+    After loading everything once, a background thread only fetches what
+    changed since its previous sync every `nutanix_inventory_sync_interval`
+    seconds, so listings are served from memory without a full listing of
+    the estate per request or cache refresh:
+
+    - VMs: The VMs affected by Prism tasks updated since the previous sync
+      are fetched again, or dropped when they no longer exist.
+    - Images: Listed most recently updated first, down to the previous sync.
+    - Subnets: Nutanix offers no way to tell what changed, they are reloaded
+      in full, which is cheap as there are few.
+
+    Changes which don't go through a Prism task, and deleted images, are
+    picked up by a full reload every `nutanix_inventory_reconcile_interval`
+    seconds.
+
+    With a sync interval of zero or less the inventory is disabled, and all
+    lookups return None, as they do until the first load is done.
+    """
+
+    def __init__(
+        self, ctx: server.Context, vmm: VirtualMachineMgmt, networking: Networking
+    ):
+        self.sync_interval = ctx.nutanix_inventory_sync_interval
+        self.reconcile_interval = ctx.nutanix_inventory_reconcile_interval
+        self._vms = _Collection("vms", vmm.list_vms, self._vm_changes(vmm))
+        self._images = _Collection(
+            "images",
+            vmm.list_images,
+            lambda since: (vmm.images_changed_since(since), set()),
+        )
+        self._subnets = _Collection("subnets", networking.list_subnets)
+        self._stop = threading.Event()
+        self._thread: None | threading.Thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sync_interval > 0
+
+    def start(self) -> None:
+        """Start syncing in the background, if enabled"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="inventory-sync", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def sync(self) -> None:
+        """Sync each collection once, a failing one is retried on the next sync"""
+        for collection in self._collections():
+            try:
+                collection.sync(self.reconcile_interval)
+            except Exception as e:
+                logger.warning(f"Inventory sync of {collection.name} failed: {e}")
+
+    def dump(self) -> dict[str, Cached[list]]:
+        """Snapshot of each loaded collection, keyed on the collection name"""
+        snapshots = {}
+        for collection in self._collections():
+            if (snapshot := collection.snapshot()) is not None:
+                snapshots[collection.name] = snapshot
+        return snapshots
+
+    def load(self, snapshots: dict[str, Cached[list]]) -> None:
+        """
+        Serve the collections of a `dump` until they are synced.
+
+        Ignored while disabled, as the loaded collections would never sync.
+        """
+        if not self.enabled:
+            return
+        for collection in self._collections():
+            if (snapshot := snapshots.get(collection.name)) is not None:
+                collection.restore(snapshot)
+
+    def vms(
+        self,
+        cluster_ext_id: None | str = None,
+        power_state: None | str = None,
+        name_prefix: None | str = None,
+    ) -> None | Cached[list[VmListMetadata]]:
+        """Synced VMs matching the filters, None if not available"""
+        return _filtered(
+            self._vms.snapshot(),
+            lambda vm: (
+                (cluster_ext_id is None or vm.cluster_ext_id == cluster_ext_id)
+                and (power_state is None or vm.power_state == power_state)
+                and _has_prefix(vm.name, name_prefix)
+            ),
+        )
+
+    def images(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> None | Cached[list[ImageMetadata]]:
+        """Synced images matching the filters, None if not available"""
+        return _filtered(
+            self._images.snapshot(),
+            lambda img: (
+                (
+                    cluster_ext_id is None
+                    or cluster_ext_id in (img.cluster_location_ext_ids or [])
+                )
+                and _has_prefix(img.name, name_prefix)
+            ),
+        )
+
+    def subnets(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> None | Cached[list[SubnetMetadata]]:
+        """Synced subnets matching the filters, None if not available"""
+        return _filtered(
+            self._subnets.snapshot(),
+            lambda subnet: (
+                (cluster_ext_id is None or subnet.cluster_ext_id == cluster_ext_id)
+                and _has_prefix(subnet.name, name_prefix)
+            ),
+        )
+
+    def _collections(self) -> list[_Collection]:
+        return [self._vms, self._images, self._subnets]
+
+    def _run(self) -> None:
+        while True:
+            self.sync()
+            if self._stop.wait(self.sync_interval):
+                return
+
+    @staticmethod
+    def _vm_changes(
+        vmm: VirtualMachineMgmt,
+    ) -> Callable[[datetime.datetime], Changes[VmListMetadata]]:
+        def changes(since: datetime.datetime) -> Changes[VmListMetadata]:
+            ext_ids = vmm.changed_vm_ext_ids(since)
+            vms = vmm.get_vms(list(ext_ids)) if ext_ids else []
+            return vms, ext_ids - {vm.ext_id for vm in vms}
+
+        return changes
+
+
+def _filtered(
+    snapshot: None | Cached[list[T]], matches: Callable[[T], bool]
+) -> None | Cached[list[T]]:
+    if snapshot is None:
+        return None
+    return Cached(
+        value=[entity for entity in snapshot.value if matches(entity)],
+        fetched_at=snapshot.fetched_at,
+    )
+
+
+def _has_prefix(name: None | str, prefix: None | str) -> bool:
+    return not prefix or (name or "").startswith(prefix)
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import enum
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from nutanix_shim_server import server
+
+logger = logging.getLogger(__name__)
+
+
+class JobState(str, enum.Enum):
+    """
+    States of a background job.
+
+    - PENDING: Accepted, waiting for a free worker
+    - RUNNING: In progress, see `progress` for the current step
+    - SUCCEEDED: Done, `result` holds the outcome
+    - FAILED: Done, `error` says what went wrong
+    """
+
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+    """
+    Response model describing a background job and, once done, its result.
+
+    Example:
+        {
+            "id": "5b0e8b1e-2f0c-4c1e-9d8f-2b7f0f6d1a3c",
+            "kind": "provision-vm",
+            "state": "RUNNING",
+            "progress": "Waiting for VM creation task ZXJnb24=:1d2c...",
+            "create_time": "2025-01-01T12:00:00Z",
+            "update_time": "2025-01-01T12:00:04Z",
+            "result": null,
+            "error": null
+        }
+    """
+
+    id: str
+    kind: str
+    state: JobState
+    progress: None | str
+    create_time: datetime.datetime
+    update_time: datetime.datetime
+    result: Any = None
+    error: None | str = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.state in (JobState.SUCCEEDED, JobState.FAILED)
+
+
+class JobManager:
+    """
+    Runs long operations (ie VM provisioning) in the background.
+
+    Jobs run on a dedicated, bounded thread pool so they don't hold on to the
+    request handling threads while waiting on Nutanix. Finished jobs are kept
+    for status lookups until more than `max_jobs` have accumulated, then the
+    oldest finished ones are dropped.
+    """
+
+    def __init__(self, ctx: server.Context, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=ctx.nutanix_job_workers, thread_name_prefix="job"
+        )
+
+    def submit(self, kind: str, fn: Callable[[Callable[[str], None]], Any]) -> Job:
+        """
+        Start `fn` in the background, returning the newly created job.
+
+        `fn` is called with a progress callback taking a message describing
+        the current step, its return value becomes the job's result.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        job = Job(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            state=JobState.PENDING,
+            progress=None,
+            create_time=now,
+            update_time=now,
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job.id, fn)
+        return job
+
+    def get(self, job_id: str) -> None | Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job_id: str, fn: Callable[[Callable[[str], None]], Any]) -> None:
+        self._update(job_id, state=JobState.RUNNING)
+        try:
+            result = fn(lambda message: self._update(job_id, progress=message))
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._update(job_id, state=JobState.FAILED, error=str(e))
+        else:
+            self._update(job_id, state=JobState.SUCCEEDED, result=result)
+
+    def _update(self, job_id: str, **changes) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            if job := self._jobs.get(job_id):
+                self._jobs[job_id] = dataclasses.replace(
+                    job, update_time=now, **changes
+                )
+
+    def _prune(self) -> None:
+        """Drop the oldest finished jobs beyond `max_jobs`"""
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [job.id for job in self._jobs.values() if job.is_done]:
+            if excess <= 0:
+                break
+            del self._jobs[job_id]
+            excess -= 1
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# From the optional `metrics` extra, without it the metrics do nothing
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+ENABLED = prometheus_client is not None
+
+# Default buckets, in seconds, of the duration histograms
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)  # fmt: skip
+# Buckets of the pages fetched per listing
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Buckets of task waits, which take seconds to many minutes
+TASK_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+class _NoOpMetric:
+    """Stands in for a metric, and each of its children, without the extra"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def labels(self, *values: str) -> _NoOpMetric:
+        return self
+
+    def inc(self, amount: float = 1.0) -> None:
+        pass
+
+    def dec(self, amount: float = 1.0) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    @contextmanager
+    def track_inprogress(self) -> Iterator[None]:
+        yield
+
+
+if prometheus_client is not None:
+    from prometheus_client import Counter, Gauge, Histogram
+
+    CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+    # The shim's own registry, without the default process and GC collectors
+    REGISTRY = prometheus_client.CollectorRegistry()
+else:  # pragma: no cover
+    Counter = Gauge = Histogram = _NoOpMetric  # type: ignore
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    REGISTRY = None
+
+
+def render() -> bytes:
+    """All metrics in the Prometheus text exposition format"""
+    if prometheus_client is None:
+        return b""
+    return prometheus_client.generate_latest(REGISTRY)
+
+
+# Requests to the shim
+REQUEST_SECONDS = Histogram(
+    "nutanix_shim_request_duration_seconds",
+    "Time to handle a request to the shim, up to its response headers",
+    ("method", "route", "status"),
+    buckets=DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "nutanix_shim_requests_in_flight",
+    "Requests to the shim being handled",
+    ("method",),
+    registry=REGISTRY,
+)
+
+# Requests to Nutanix
+UPSTREAM_SECONDS = Histogram(
+    "nutanix_shim_upstream_duration_seconds",
+    "Time of a Nutanix API call including retries and decoding the response",
+    ("operation", "outcome"),
+    buckets=DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "nutanix_shim_upstream_in_flight",
+    "Nutanix API calls in progress",
+    ("operation",),
+    registry=REGISTRY,
+)
+UPSTREAM_RETRIES = Counter(
+    "nutanix_shim_upstream_retries_total",
+    "Retries of Nutanix API requests, ie on 429 or 503 responses",
+    ("operation",),
+    registry=REGISTRY,
+)
+LISTING_PAGES = Histogram(
+    "nutanix_shim_listing_pages",
+    "Pages fetched to list all entities of a Nutanix list call",
+    ("operation",),
+    buckets=PAGE_BUCKETS,
+    registry=REGISTRY,
+)
+TASK_WAIT_SECONDS = Histogram(
+    "nutanix_shim_task_wait_duration_seconds",
+    "Time from watching a Prism task until it was seen to end",
+    ("status",),
+    buckets=TASK_BUCKETS,
+    registry=REGISTRY,
+)
+TASK_POLLS = Counter(
+    "nutanix_shim_task_polls_total",
+    "Batched polls of watched Prism tasks",
+    ("outcome",),
+    registry=REGISTRY,
+)
+
+# Caches and bulkheads
+CACHE_LOOKUPS = Counter(
+    "nutanix_shim_cache_lookups_total",
+    "Lookups of the inventory cache, by whether they were served from it",
+    ("resource", "result"),
+    registry=REGISTRY,
+)
+RENDERED_LOOKUPS = Counter(
+    "nutanix_shim_rendered_cache_lookups_total",
+    "Lookups of encoded list responses, by whether they were encoded already",
+    ("result",),
+    registry=REGISTRY,
+)
+BULKHEAD_ACTIVE = Gauge(
+    "nutanix_shim_bulkhead_active",
+    "Calls running on a bulkhead",
+    ("bulkhead",),
+    registry=REGISTRY,
+)
+BULKHEAD_QUEUED = Gauge(
+    "nutanix_shim_bulkhead_queued",
+    "Calls waiting for a thread of a bulkhead",
+    ("bulkhead",),
+    registry=REGISTRY,
+)
+BULKHEAD_WAIT_SECONDS = Histogram(
+    "nutanix_shim_bulkhead_wait_duration_seconds",
+    "Time calls waited for a thread of a bulkhead",
+    ("bulkhead",),
+    buckets=DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+
+# Nutanix API call of the current thread, for `count_retries`
+_operation: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "operation", default="unknown"
+)
+
+
+@contextmanager
+def upstream_call(operation: str) -> Iterator[None]:
+    """
+    Record the duration and outcome of a Nutanix API call.
+
+    `operation` should name the endpoint rather than the entity, ie
+    "GET /api/vmm/v4.0/ahv/config/vms/{extId}".
+    """
+    token = _operation.set(operation)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with UPSTREAM_IN_FLIGHT.labels(operation).track_inprogress():
+            yield
+        outcome = "success"
+    finally:
+        _operation.reset(token)
+        UPSTREAM_SECONDS.labels(operation, outcome).observe(
+            time.perf_counter() - started
+        )
+
+
+def count_retries(retries: int) -> None:
+    """Count retries of a request made by the current Nutanix API call"""
+    if retries > 0:
+        UPSTREAM_RETRIES.labels(_operation.get()).inc(retries)
@@ -2,38 +2,28 @@ from __future__ import annotations
 
 import dataclasses
 import logging
-from typing import Self, cast
+from typing import Any, Iterator, Self, cast
 
 import ntnx_networking_py_client as net
 
-from nutanix_shim_server import server
-from nutanix_shim_server.utils import paginate
+from nutanix_shim_server import raw, server, tracing
+from nutanix_shim_server.clients import NutanixClients
+from nutanix_shim_server.singleflight import single_flight
+from nutanix_shim_server.utils import iter_pages, odata_filter, odata_str
 
 logger = logging.getLogger(__name__)
 
 
 class Networking:
-    config: net.Configuration
-
-    def __init__(self, ctx: server.Context):
-        self.config = net.Configuration()
-        self.config.host = ctx.nutanix_host
-        self.config.scheme = ctx.nutanix_host_scheme
-        self.config.set_api_key(ctx.nutanix_api_key)
-        self.config.max_retry_attempts = 3
-        self.config.backoff_factor = 3
-        self.config.verify_ssl = ctx.nutanix_host_verify_ssl
-        self.config.port = ctx.nutanix_host_port
-        self.config.client_certificate_file = ctx.nutanix_client_certificate_file
-        self.config.root_ca_certificate_file = ctx.nutanix_root_ca_certificate_file
+    def __init__(self, ctx: server.Context, clients: None | NutanixClients = None):
+        self.clients = clients or NutanixClients(ctx)
+        self.pagination_concurrency = ctx.nutanix_pagination_concurrency
+        self.raw_json = ctx.nutanix_raw_json
 
     @property
     def client(self) -> net.ApiClient:
         if not hasattr(self, "_client"):
-            self._client = net.ApiClient(self.config)
-            self._client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+            self._client = self.clients.networking_client()
         return self._client
 
     @property
@@ -42,10 +32,38 @@ class Networking:
             self._subnets_api = net.SubnetsApi(api_client=self.client)
         return self._subnets_api
 
-    def list_subnets(self) -> list[SubnetMetadata]:
-        """Return list of available subnets/networks"""
-        subnets: list[net.Subnet] = paginate(self.subnets_api.list_subnets)
-        return [SubnetMetadata.from_nutanix_subnet(subnet) for subnet in subnets]
+    @single_flight
+    def list_subnets(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> list[SubnetMetadata]:
+        """Return list of available subnets/networks, optionally filtered"""
+        return [
+            subnet
+            for page in self.iter_subnets(cluster_ext_id, name_prefix)
+            for subnet in page
+        ]
+
+    def iter_subnets(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> Iterator[list[SubnetMetadata]]:
+        """Yield available subnets/networks one converted page at a time"""
+        if self.raw_json:
+            list_subnets = raw.list_op(self.client, raw.SUBNETS_PATH)
+            convert = SubnetMetadata.from_json
+        else:
+            list_subnets = self.subnets_api.list_subnets
+            convert = SubnetMetadata.from_nutanix_subnet
+        for page in iter_pages(  # type: ignore
+            list_subnets,
+            concurrency=self.pagination_concurrency,
+            _filter=odata_filter(
+                cluster_ext_id and f"clusterReference eq {odata_str(cluster_ext_id)}",
+                name_prefix and f"startswith(name, {odata_str(name_prefix)})",
+            ),
+        ):
+            with tracing.span("convert", "SubnetMetadata"):
+                subnets = [convert(subnet) for subnet in page]
+            yield subnets
 
 
 @dataclasses.dataclass(frozen=True)
@@ -104,17 +122,6 @@ class SubnetMetadata:
                         str, ipv4_config.dhcp_server_address.value
                     )
 
-        # Check if cluster_ext_id exists (it might be in cluster_reference)
-        cluster_ext_id = None
-        if hasattr(subnet, "cluster_ext_id"):
-            cluster_ext_id = subnet.cluster_ext_id  # type: ignore
-        elif hasattr(subnet, "cluster_reference") and subnet.cluster_reference:
-            cluster_ext_id = (
-                subnet.cluster_reference.ext_id
-                if hasattr(subnet.cluster_reference, "ext_id")
-                else None
-            )
-
         return cls(
             ext_id=cast(str, subnet.ext_id),
             name=cast(str, subnet.name),
@@ -122,7 +129,8 @@ class SubnetMetadata:
             subnet_type=str(subnet.subnet_type) if subnet.subnet_type else None,
             network_id=subnet.network_id,
             cluster_name=subnet.cluster_name,
-            cluster_ext_id=cluster_ext_id,
+            # The v4 API references the cluster by its ext_id
+            cluster_ext_id=subnet.cluster_reference,
             ipv4_subnet=ipv4_subnet,
             ipv4_gateway=ipv4_gateway,
             dhcp_server_address=dhcp_server_address,
@@ -130,3 +138,38 @@ class SubnetMetadata:
             is_external=subnet.is_external,
             vpc_reference=subnet.vpc_reference,
         )
+
+    @classmethod
+    def from_json(cls, subnet: dict[str, Any]) -> Self:
+        """Convert a subnet of a raw JSON response, like `from_nutanix_subnet`"""
+        ipv4_subnet = None
+        ipv4_gateway = None
+        dhcp_server_address = None
+
+        if ip_config := subnet.get("ipConfig"):
+            if ipv4_config := ip_config[0].get("ipv4"):
+                if ip_subnet := ipv4_config.get("ipSubnet"):
+                    ip = (ip_subnet.get("ip") or {}).get("value")
+                    prefix = ip_subnet.get("prefixLength")
+                    if ip and prefix:
+                        ipv4_subnet = f"{ip}/{prefix}"
+                if gateway := ipv4_config.get("defaultGatewayIp"):
+                    ipv4_gateway = gateway.get("value")
+                if dhcp_server := ipv4_config.get("dhcpServerAddress"):
+                    dhcp_server_address = dhcp_server.get("value")
+
+        return cls(
+            ext_id=subnet["extId"],
+            name=subnet["name"],
+            description=subnet.get("description"),
+            subnet_type=subnet.get("subnetType"),
+            network_id=subnet.get("networkId"),
+            cluster_name=subnet.get("clusterName"),
+            cluster_ext_id=subnet.get("clusterReference"),
+            ipv4_subnet=ipv4_subnet,
+            ipv4_gateway=ipv4_gateway,
+            dhcp_server_address=dhcp_server_address,
+            is_nat_enabled=subnet.get("isNatEnabled"),
+            is_external=subnet.get("isExternal"),
+            vpc_reference=subnet.get("vpcReference"),
+        )
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import dataclasses
+import random
+import time
+from typing import Callable, Generic, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """A point in time by which an operation must be done"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+@dataclasses.dataclass(frozen=True)
+class Backoff:
+    """
+    Exponential backoff schedule for polling.
+
+    Starts at `initial` seconds and multiplies by `factor` after each poll, up
+    to `maximum`. Each interval is spread by +/- `jitter` (a fraction of the
+    interval) so waiters started together don't poll in lockstep.
+    """
+
+    initial: float = 0.5
+    factor: float = 2.0
+    maximum: float = 5.0
+    jitter: float = 0.1
+
+    def intervals(self) -> Iterator[float]:
+        interval = self.initial
+        while True:
+            spread = interval * self.jitter
+            yield max(0.0, interval + random.uniform(-spread, spread))
+            interval = min(interval * self.factor, self.maximum)
+
+
+@dataclasses.dataclass(frozen=True)
+class PollResult(Generic[T]):
+    """Outcome of a wait, with how many polls and seconds it took"""
+
+    value: T
+    polls: int
+    elapsed: float
+
+
+def poll_until(
+    check: Callable[[], None | T],
+    deadline: Deadline,
+    backoff: Backoff = Backoff(),
+    what: str = "condition",
+) -> PollResult[T]:
+    """
+    Call `check` until it returns something other than None.
+
+    Sleeps between polls following `backoff`, cut short to not overrun the
+    deadline. The last poll happens at the deadline.
+
+    Parameters
+    ----------
+        check: Returns None while still waiting, otherwise the result
+        deadline: When to give up
+        backoff: Schedule of sleeps between polls
+        what: Description of what is waited on, for the timeout message
+
+    Returns
+    -------
+    PollResult
+        with the value returned by `check`
+
+    Raises
+    ------
+        TimeoutError: If the deadline passes first
+    """
+    started = time.monotonic()
+    polls = 0
+    for interval in backoff.intervals():
+        polls += 1
+        if (value := check()) is not None:
+            return PollResult(value, polls, time.monotonic() - started)
+        if deadline.expired:
+            break
+        time.sleep(min(interval, deadline.remaining()))
+
+    raise TimeoutError(
+        f"Timed out waiting for {what} after {polls} polls "
+        f"in {time.monotonic() - started:.1f} seconds"
+    )
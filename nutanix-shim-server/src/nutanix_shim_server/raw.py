@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import json
+from typing import Any, Callable
+
+from dateutil.parser import isoparse
+from ntnx_vmm_py_client.rest import ApiException
+
+from nutanix_shim_server import metrics, tracing
+from nutanix_shim_server.clients import ACCEPT_ENCODING
+
+try:
+    import orjson
+
+    loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:  # pragma: no cover
+    loads = json.loads
+
+# List endpoints of the v4 APIs read on the raw JSON path
+VMS_PATH = "/api/vmm/v4.0/ahv/config/vms"
+IMAGES_PATH = "/api/vmm/v4.0/content/images"
+SUBNETS_PATH = "/api/networking/v4.0/config/subnets"
+
+
+@dataclasses.dataclass(frozen=True)
+class RawLink:
+    rel: None | str
+    href: None | str
+
+
+@dataclasses.dataclass(frozen=True)
+class RawMetadata:
+    total_available_results: None | int
+    links: list[RawLink]
+
+
+@dataclasses.dataclass(frozen=True)
+class RawPage:
+    """
+    Page of a v4 list response with the items left as decoded JSON.
+
+    Mirrors the `data` and `metadata` of the SDK list responses, so
+    `iter_pages` paginates raw list calls the same way as SDK ones.
+    """
+
+    data: None | list[dict[str, Any]]
+    metadata: RawMetadata
+
+    @classmethod
+    def from_json(cls, body: dict[str, Any]) -> RawPage:
+        metadata = body.get("metadata") or {}
+        return cls(
+            data=body.get("data"),
+            metadata=RawMetadata(
+                total_available_results=metadata.get("totalAvailableResults"),
+                links=[
+                    RawLink(rel=link.get("rel"), href=link.get("href"))
+                    for link in metadata.get("links") or []
+                ],
+            ),
+        )
+
+
+def get_json(api_client, path: str, query_params: list[tuple[str, Any]]) -> Any:
+    """
+    GET `path` with an SDK `ApiClient`, returning the decoded JSON body.
+
+    The request goes through the client's connection pool, with its retries
+    and timeouts, but the body is decoded with orjson (when installed)
+    instead of being deserialized into SDK models. Error responses raise
+    `ApiException` like the SDK methods do.
+    """
+    config = api_client.configuration
+    headers = {"Accept": "application/json", "Accept-Encoding": ACCEPT_ENCODING}
+    # The SDK only applies authentication in its private request pipeline
+    for auth in config._auth_settings().values():
+        if auth["value"] and auth["in"] == "header":
+            headers[auth["key"]] = auth["value"]
+            break
+
+    url = f"{config.scheme}://{config.host}:{config.port}{path}"
+    operation = f"GET {path}"
+    with metrics.upstream_call(operation), tracing.span("upstream", operation):
+        resp = api_client.request(
+            "GET",
+            url,
+            query_params=query_params,
+            headers=headers,
+            _preload_content=False,
+        )
+        try:
+            if resp.status == 401:
+                raise ApiException(http_resp=resp)
+            return loads(resp.urllib3_response.data)
+        finally:
+            resp.urllib3_response.release_conn()
+
+
+def list_op(api_client, path: str) -> Callable[..., RawPage]:
+    """
+    Raw JSON counterpart of an SDK `list_*` method, for `iter_pages`.
+
+    Takes the same `_page`, `_limit`, `_filter`, `_orderby` and `_select`
+    parameters and returns a `RawPage`.
+    """
+
+    def op(
+        _page: None | int = None,
+        _limit: None | int = None,
+        _filter: None | str = None,
+        _orderby: None | str = None,
+        _select: None | str = None,
+    ) -> RawPage:
+        params = {
+            "$page": _page,
+            "$limit": _limit,
+            "$filter": _filter,
+            "$orderby": _orderby,
+            "$select": _select,
+        }
+        query_params = [(k, v) for k, v in params.items() if v is not None]
+        return RawPage.from_json(get_json(api_client, path, query_params))
+
+    # Named like the SDK method, for the metrics of `iter_pages`
+    op.__name__ = f"list_{path.rsplit('/', 1)[-1]}"
+    return op
+
+
+def parse_datetime(value: None | str) -> None | datetime.datetime:
+    """Parse an ISO 8601 timestamp of a JSON body"""
+    return isoparse(value) if value else None
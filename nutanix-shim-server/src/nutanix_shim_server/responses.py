@@ -0,0 +1,386 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import dataclasses
+import datetime
+import enum
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, TypeVar
+
+from fastapi import HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+
+from nutanix_shim_server import metrics, server, tracing
+from nutanix_shim_server.cache import Cached
+from nutanix_shim_server.utils import ListPage
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+T = TypeVar("T")
+
+ZERO = datetime.timedelta(0)
+
+# Smaller bodies are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+# Largest page size, that of Nutanix so a page maps onto one upstream page
+MAX_PAGE_LIMIT = 100
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode response models (dataclasses, datetimes, enums) as JSON.
+
+    Uses orjson, which encodes dataclasses natively, when installed. The
+    result matches what FastAPI makes of the same models.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+def _default(value: Any) -> Any:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {f.name: getattr(value, f.name) for f in dataclasses.fields(value)}
+    if isinstance(value, datetime.datetime) and value.utcoffset() == ZERO:
+        return value.isoformat().replace("+00:00", "Z")
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response of the shim's response models, encoded with `dumps`.
+
+    Returned by a route instead of its content, FastAPI skips validating and
+    re-encoding the content against the route's `response_model` (which then
+    only documents the response). As the content is not validated, it must
+    be of the declared model. See `json_response`.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with tracing.span("serialize"):
+            return dumps(content)
+
+
+def json_response(response: Response, content: Any) -> FastJSONResponse:
+    """
+    Respond with `content` as a `FastJSONResponse`.
+
+    Headers set on the route's `response` parameter are carried over, as
+    FastAPI ignores them once a response is returned.
+    """
+    fast = FastJSONResponse(content)
+    fast.headers.raw.extend(response.headers.raw)
+    return fast
+
+
+def ndjson_response(
+    pages: Iterable[list[object]] | AsyncIterable[list[object]],
+) -> StreamingResponse:
+    """
+    Stream pages of response models as newline-delimited JSON.
+
+    Each page is encoded and written out before the next one is pulled from
+    `pages`, so with a lazy page iterator (ie `VirtualMachineMgmt.iter_vms`)
+    only a single page is held in memory at any time. Pass an async iterator
+    (ie from `Bulkhead.iterate`) to control which threads fetch the pages.
+    """
+    if isinstance(pages, AsyncIterable):
+        content = _aiter_ndjson(pages)
+    else:
+        content = _iter_ndjson(pages)
+    return StreamingResponse(content, media_type=NDJSON_MEDIA_TYPE)
+
+
+def _iter_ndjson(pages: Iterable[list[object]]) -> Iterator[bytes]:
+    for page in pages:
+        if chunk := _ndjson_chunk(page):
+            yield chunk
+
+
+async def _aiter_ndjson(pages: AsyncIterable[list[object]]) -> AsyncIterator[bytes]:
+    async for page in pages:
+        if chunk := _ndjson_chunk(page):
+            yield chunk
+
+
+def _ndjson_chunk(page: list[object]) -> bytes:
+    lines = [dumps(item) for item in page]
+    return b"\n".join(lines) + b"\n" if lines else b""
+
+
+@dataclasses.dataclass
+class Rendered:
+    """Encoded body of a cached value, and its ETag"""
+
+    fetched_at: float
+    body: bytes
+    etag: str
+    gzipped: None | bytes = None
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzipped or b"")
+
+
+class RenderedCache:
+    """
+    Encoded response bodies of cached values, keyed on the request.
+
+    The body of a request is only encoded again once the cached value it was
+    encoded from has been fetched anew, which `Cached.fetched_at` tells.
+    Bodies are gzipped on first use, if enabled. At most `max_entries`
+    requests, and `max_bytes` of their bodies, are kept, dropping the least
+    recently used beyond that. A body larger than `max_bytes` is not kept.
+    """
+
+    def __init__(self, ctx: server.Context):
+        self.gzip = ctx.nutanix_response_gzip
+        self.max_entries = ctx.nutanix_cache_max_entries
+        self.max_bytes = ctx.nutanix_response_cache_max_bytes
+        self._entries: OrderedDict[str, Rendered] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Bytes of the bodies kept"""
+        return self._size
+
+    def get(self, key: str, cached: Cached) -> Rendered:
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is not None and rendered.fetched_at == cached.fetched_at:
+                self._entries.move_to_end(key)
+                metrics.RENDERED_LOOKUPS.labels("hit").inc()
+                return rendered
+
+        metrics.RENDERED_LOOKUPS.labels("miss").inc()
+        with tracing.span("serialize"):
+            body = dumps(cached.value)
+        # Weak, as the gzipped and identity encodings of the body share it
+        etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        rendered = Rendered(fetched_at=cached.fetched_at, body=body, etag=etag)
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self._size -= previous.size
+            if rendered.size <= self.max_bytes:
+                self._entries[key] = rendered
+                self._size += rendered.size
+                self._evict()
+        return rendered
+
+    def gzipped(self, key: str, rendered: Rendered) -> bytes:
+        if rendered.gzipped is None:
+            with tracing.span("gzip"):
+                gzipped = gzip.compress(rendered.body, compresslevel=5)
+            with self._lock:
+                if rendered.gzipped is None:
+                    rendered.gzipped = gzipped
+                    if self._entries.get(key) is rendered:
+                        self._size += len(gzipped)
+                        self._evict()
+        return rendered.gzipped
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._size > self.max_bytes
+        ):
+            _, rendered = self._entries.popitem(last=False)
+            self._size -= rendered.size
+
+
+@dataclasses.dataclass(frozen=True)
+class PageRequest:
+    """The page of a listing asked for with `limit` and `cursor`"""
+
+    offset: int
+    limit: int
+
+
+def page_request(
+    limit: None | int = Query(
+        None,
+        ge=1,
+        le=MAX_PAGE_LIMIT,
+        description="Return at most this many items, and a cursor to the next ones",
+    ),
+    cursor: None | str = Query(
+        None,
+        description="The `X-Next-Cursor` of the previous page, to get the next one",
+    ),
+) -> None | PageRequest:
+    """
+    Dependency of the paginated list routes, None unless a page is asked for.
+
+    A `cursor` holds the page size it was made for, which a `limit` given
+    with it must match, as the pages of Nutanix can't be resized midway.
+    """
+    if limit is None and cursor is None:
+        return None
+    if cursor is None:
+        return PageRequest(offset=0, limit=limit or MAX_PAGE_LIMIT)
+    page = _decode_cursor(cursor)
+    if limit is not None and limit != page.limit:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cursor is for pages of {page.limit} items, not {limit}",
+        )
+    return page
+
+
+def _encode_cursor(offset: int, limit: int) -> str:
+    cursor = base64.urlsafe_b64encode(f"offset:{offset}:{limit}".encode())
+    return cursor.decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> PageRequest:
+    try:
+        kind, offset, limit = base64.urlsafe_b64decode(cursor + "==").split(b":")
+        page = PageRequest(offset=int(offset), limit=int(limit))
+        if (
+            kind != b"offset"
+            or page.offset < 0
+            or not 1 <= page.limit <= MAX_PAGE_LIMIT
+        ):
+            raise ValueError(cursor)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{cursor}'")
+    return page
+
+
+def page_response(response: Response, page: ListPage) -> FastJSONResponse:
+    """Respond with the items of a page, see `set_page_headers`"""
+    set_page_headers(response, page)
+    return json_response(response, page.items)
+
+
+def set_page_headers(response: Response, page: ListPage) -> None:
+    """
+    Describe a page in the headers of its response.
+
+    - X-Total-Count: Number of all matching items, if known
+    - X-Next-Cursor: Cursor of the next page, unless this is the last one
+    """
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+    if (next_offset := page.next_offset) is not None:
+        response.headers["X-Next-Cursor"] = _encode_cursor(next_offset, page.limit)
+
+
+def cached_response(
+    request: Request, cached: Cached, page: None | PageRequest = None
+) -> Response:
+    """
+    Respond with a cached value, encoded once per fetch of the value.
+
+    The body is served from the app's `RenderedCache` with an `ETag` of its
+    content, and a request whose `If-None-Match` holds that ETag gets a `304
+    Not Modified` without a body. As the ETag hashes the content, it holds
+    across refreshes which didn't change anything. The `Age` header gives the
+    number of seconds since the value was fetched from Nutanix.
+
+    With a `page`, only that page of the (list) value is returned.
+    """
+    list_page = None
+    if page is not None:
+        list_page = ListPage.of(cached.value, page.offset, page.limit)
+        cached = Cached(value=list_page.items, fetched_at=cached.fetched_at)
+
+    renderer: RenderedCache = request.app.state.rendered
+    key = _request_key(request)
+    rendered = renderer.get(key, cached)
+    headers = {
+        "ETag": rendered.etag,
+        "Age": str(int(cached.age)),
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), rendered.etag):
+        response = Response(status_code=304, headers=headers)
+    else:
+        body = rendered.body
+        if (
+            renderer.gzip
+            and len(body) >= GZIP_MIN_SIZE
+            and _accepts_gzip(request.headers.get("accept-encoding", ""))
+        ):
+            body = renderer.gzipped(key, rendered)
+            headers["Content-Encoding"] = "gzip"
+        response = Response(body, media_type="application/json", headers=headers)
+
+    if list_page is not None:
+        set_page_headers(response, list_page)
+    return response
+
+
+def _request_key(request: Request) -> str:
+    """
+    Key of a request on its path and the query parameters its route declares.
+
+    Other parameters, ie a cache buster like `?_=123`, don't change the
+    response, so must not make another copy of it in the `RenderedCache`.
+    """
+    names = _query_names(request.scope.get("route"))
+    params = sorted(
+        (name, value)
+        for name, value in request.query_params.multi_items()
+        if names is None or name in names
+    )
+    return f"{request.url.path}?{params}"
+
+
+def _query_names(route: object) -> None | set[str]:
+    """Query parameters of a route and its dependencies, None if unknown"""
+    if not isinstance(route, APIRoute):
+        return None
+    names = set()
+    dependants = [route.dependant]
+    while dependants:
+        dependant = dependants.pop()
+        names.update(param.alias for param in dependant.query_params)
+        dependants.extend(dependant.dependencies)
+    return names
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an `Accept-Encoding` header allows gzip, ie not with `q=0`"""
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, *params = (part.strip() for part in coding.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def _etag_matches(if_none_match: None | str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Compare weakly, ie regardless of the `W/` prefix
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
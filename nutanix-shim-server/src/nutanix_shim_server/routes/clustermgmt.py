@@ -1,11 +1,20 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Query, Request, Response
 
+from nutanix_shim_server.bulkheads import Bulkheads
+from nutanix_shim_server.cache import InventoryCache
 from nutanix_shim_server.clustermgmt import (
     ClusterMetadata,
     ClusterMgmt,
     ClusterResourceStats,
+    ClusterStatsResult,
     StorageContainerMetadata,
 )
+from nutanix_shim_server.responses import (
+    PageRequest,
+    cached_response,
+    ndjson_response,
+    page_request,
+)
 
 router = APIRouter(prefix="/api/v1/clustermgmt", tags=["Cluster Management"])
 
@@ -14,10 +23,29 @@ router = APIRouter(prefix="/api/v1/clustermgmt", tags=["Cluster Management"])
     "/list-clusters",
     response_model=list[ClusterMetadata],
     tags=["Cluster Management"],
+    description="""
+    Returns a list of all clusters in the Nutanix environment.
+
+    Served from the shim's inventory cache, the `Age` response header gives
+    the number of seconds since the data was fetched from Nutanix.
+
+    The response carries an `ETag`, send it as `If-None-Match` to get an empty
+    `304 Not Modified` while the data is unchanged.
+
+    Pass `limit` (at most 100) to get one page of clusters, then the `X-Next-Cursor`
+    response header as `cursor` for the next page, until it is left out. A cursor
+    keeps the page size it was made with, so leave `limit` out or unchanged. The
+    `X-Total-Count` header gives the number of matching clusters.
+    """,
 )
-def list_clusters(request: Request) -> list[ClusterMetadata]:
+async def list_clusters(
+    request: Request, page: None | PageRequest = Depends(page_request)
+) -> Response:
     api: ClusterMgmt = request.app.state.clustermgmt
-    return api.list_clusters()
+    cache: InventoryCache = request.app.state.cache
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    cached = await bulkheads.listing.run(cache.get, "clusters", api.list_clusters)
+    return cached_response(request, cached, page)
 
 
 @router.get(
@@ -50,9 +78,54 @@ def list_clusters(request: Request) -> list[ClusterMetadata]:
     ```
     """,
 )
-def get_cluster_stats(cluster_id: str, request: Request) -> ClusterResourceStats:
+async def get_cluster_stats(cluster_id: str, request: Request) -> ClusterResourceStats:
+    api: ClusterMgmt = request.app.state.clustermgmt
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.listing.run(api.get_cluster_stats, cluster_id)
+
+
+@router.get(
+    "/stats",
+    response_model=list[ClusterStatsResult],
+    summary="Get resource statistics of many clusters",
+    description="""
+    Returns the resource statistics (see `GET /api/v1/clustermgmt/clusters/{cluster_id}/stats`)
+    of every cluster, or of the clusters given as `cluster_ext_ids`, either repeated
+    (`?cluster_ext_ids=a&cluster_ext_ids=b`) or comma separated (`?cluster_ext_ids=a,b`).
+
+    Clusters are queried concurrently, at most `NUTANIX_CLUSTER_STATS_CONCURRENCY`
+    (default 6) at a time. A cluster whose stats can't be fetched gets an `error`
+    instead, the other clusters are still returned.
+
+    Example response:
+    ```json
+    [
+        {
+            "ext_id": "00061663-9fa0-28ca-185b-ac1f6b6f97e2",
+            "stats": {"ext_id": "00061663-9fa0-28ca-185b-ac1f6b6f97e2", "cpu_usage_percent": 25.0, ...},
+            "error": null
+        },
+        {
+            "ext_id": "0005f8c2-1b3d-4e5f-8a9b-0c1d2e3f4a5b",
+            "stats": null,
+            "error": "(500) Reason: Internal Server Error ..."
+        }
+    ]
+    ```
+    """,
+)
+async def get_clusters_stats(
+    request: Request,
+    cluster_ext_ids: None | list[str] = Query(
+        None, description="External IDs of the clusters, all clusters if not given"
+    ),
+) -> list[ClusterStatsResult]:
     api: ClusterMgmt = request.app.state.clustermgmt
-    return api.get_cluster_stats(cluster_id)
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    ext_ids = None
+    if cluster_ext_ids is not None:
+        ext_ids = [i for value in cluster_ext_ids for i in value.split(",") if i]
+    return await bulkheads.listing.run(api.get_clusters_stats, ext_ids)
 
 
 @router.get(
@@ -86,8 +159,53 @@ def get_cluster_stats(cluster_id: str, request: Request) -> ClusterResourceStats
         }
     ]
     ```
+
+    Filter parameters are passed on to Nutanix, so only matching storage containers are fetched.
+
+    Set `stream=true` to receive newline-delimited JSON (`application/x-ndjson`),
+    one storage container per line, written out page by page as they arrive from Nutanix.
+
+    Unless streamed, the response is served from the shim's inventory cache and
+    the `Age` header gives the number of seconds since it was fetched from Nutanix.
+
+    Such responses carry an `ETag`, send it as `If-None-Match` to get an empty
+    `304 Not Modified` while the data is unchanged.
+
+    Pass `limit` (at most 100) to get one page of storage containers, then the `X-Next-Cursor`
+    response header as `cursor` for the next page, until it is left out. A cursor
+    keeps the page size it was made with, so leave `limit` out or unchanged. The
+    `X-Total-Count` header gives the number of matching storage containers. Streamed
+    responses are not paginated.
     """,
 )
-def list_storage_containers(request: Request) -> list[StorageContainerMetadata]:
+async def list_storage_containers(
+    request: Request,
+    cluster_ext_id: None | str = Query(
+        None, description="Only storage containers on the cluster with this external ID"
+    ),
+    name_prefix: None | str = Query(
+        None,
+        description="Only storage containers with a name starting with this prefix",
+    ),
+    stream: bool = Query(
+        False, description="Stream storage containers as newline-delimited JSON"
+    ),
+    page: None | PageRequest = Depends(page_request),
+) -> Response:
     api: ClusterMgmt = request.app.state.clustermgmt
-    return api.list_storage_containers()
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    if stream:
+        return ndjson_response(
+            bulkheads.listing.iterate(
+                api.iter_storage_containers(cluster_ext_id, name_prefix)
+            )
+        )
+    cache: InventoryCache = request.app.state.cache
+    cached = await bulkheads.listing.run(
+        cache.get,
+        "storage_containers",
+        api.list_storage_containers,
+        cluster_ext_id=cluster_ext_id,
+        name_prefix=name_prefix,
+    )
+    return cached_response(request, cached, page)
@@ -0,0 +1,59 @@
+import time
+
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from nutanix_shim_server import metrics
+
+router = APIRouter(tags=["Shim Status"])
+
+
+@router.get(
+    "/metrics",
+    response_class=Response,
+    summary="Get the shim's metrics for Prometheus",
+    description="""
+    Returns the shim's metrics in the Prometheus text exposition format:
+
+    - **nutanix_shim_request_duration_seconds**: Requests to the shim, per route
+    - **nutanix_shim_upstream_duration_seconds**: Nutanix API calls, per endpoint,
+      including every page of a listing, VM lookups, task polls and power actions
+    - **nutanix_shim_upstream_retries_total**: Retries of Nutanix requests
+    - **nutanix_shim_listing_pages**: Pages fetched per listing
+    - **nutanix_shim_task_wait_duration_seconds**: Waits on Prism tasks
+    - **nutanix_shim_*_in_flight**: Requests and Nutanix calls in progress
+    - **nutanix_shim_cache_lookups_total**: Inventory cache hits and misses
+    - **nutanix_shim_bulkhead_***: Load of the bulkheads, and time spent queued
+
+    Comparing the route durations with the upstream durations of a request
+    tells how much of it was Prism Central, and how much the shim itself.
+
+    Requires the shim's `metrics` extra (`prometheus-client`), and responds
+    with `404 Not Found` without it.
+    """,
+)
+async def get_metrics() -> Response:
+    if not metrics.ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail="Metrics require the `metrics` extra, ie "
+            "`pip install nutanix-shim-server[metrics]`",
+        )
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def record_request(request: Request, call_next) -> Response:
+    """Middleware recording the duration of each request, per route template"""
+    started = time.perf_counter()
+    status = "500"
+    try:
+        with metrics.REQUESTS_IN_FLIGHT.labels(request.method).track_inprogress():
+            response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # Set by the router, ie `/api/v1/vmm/vms/{vm_id}`. Not the request path
+        # for unknown URLs, which would add a time series per URL
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.REQUEST_SECONDS.labels(request.method, route, status).observe(
+            time.perf_counter() - started
+        )
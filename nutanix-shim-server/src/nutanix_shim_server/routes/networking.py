@@ -1,6 +1,15 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Query, Request, Response
 
+from nutanix_shim_server.bulkheads import Bulkheads
+from nutanix_shim_server.cache import InventoryCache
+from nutanix_shim_server.inventory import Inventory
 from nutanix_shim_server.networking import Networking, SubnetMetadata
+from nutanix_shim_server.responses import (
+    PageRequest,
+    cached_response,
+    ndjson_response,
+    page_request,
+)
 
 router = APIRouter(prefix="/api/v1/networking", tags=["Networking"])
 
@@ -39,8 +48,54 @@ router = APIRouter(prefix="/api/v1/networking", tags=["Networking"])
         }
     ]
     ```
+
+    Filter parameters are passed on to Nutanix, so only matching networks are fetched.
+
+    Set `stream=true` to receive newline-delimited JSON (`application/x-ndjson`),
+    one network per line, written out page by page as they arrive from Nutanix.
+
+    Unless streamed, the response is served from the shim's inventory (or its
+    inventory cache while the inventory sync is disabled) and the `Age` header
+    gives the number of seconds since it was synced from Nutanix.
+
+    Such responses carry an `ETag`, send it as `If-None-Match` to get an empty
+    `304 Not Modified` while the data is unchanged.
+
+    Pass `limit` (at most 100) to get one page of networks, then the `X-Next-Cursor`
+    response header as `cursor` for the next page, until it is left out. A cursor
+    keeps the page size it was made with, so leave `limit` out or unchanged. The
+    `X-Total-Count` header gives the number of matching networks. Streamed
+    responses are not paginated.
     """,
 )
-def list_networks(request: Request) -> list[SubnetMetadata]:
+async def list_networks(
+    request: Request,
+    cluster_ext_id: None | str = Query(
+        None, description="Only networks on the cluster with this external ID"
+    ),
+    name_prefix: None | str = Query(
+        None, description="Only networks with a name starting with this prefix"
+    ),
+    stream: bool = Query(
+        False, description="Stream networks as newline-delimited JSON"
+    ),
+    page: None | PageRequest = Depends(page_request),
+) -> Response:
     api: Networking = request.app.state.networking
-    return api.list_subnets()
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    if stream:
+        return ndjson_response(
+            bulkheads.listing.iterate(api.iter_subnets(cluster_ext_id, name_prefix))
+        )
+    inventory: Inventory = request.app.state.inventory
+    if (synced := inventory.subnets(cluster_ext_id, name_prefix)) is not None:
+        return cached_response(request, synced, page)
+    cache: InventoryCache = request.app.state.cache
+    cached = await bulkheads.listing.run(
+        cache.get,
+        "subnets",
+        api.list_subnets,
+        cluster_ext_id=cluster_ext_id,
+        name_prefix=name_prefix,
+    )
+    return cached_response(request, cached, page)
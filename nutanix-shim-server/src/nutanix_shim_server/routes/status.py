@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Request
+
+from nutanix_shim_server.bulkheads import Bulkheads, BulkheadStats
+
+router = APIRouter(prefix="/api/v1/status", tags=["Shim Status"])
+
+
+@router.get(
+    "/bulkheads",
+    response_model=list[BulkheadStats],
+    summary="Get the load of the shim's bulkheads",
+    description="""
+    Returns the current load of each bulkhead, the bounded thread pools the
+    shim runs its Nutanix calls on:
+
+    - **provisioning**: VM provisioning and bulk power actions
+    - **listing**: Inventory listings and other calls enumerating many entities
+    - **lookup**: Calls on a single entity, ie VM details or power state
+
+    Sizes are set with `NUTANIX_BULKHEAD_SIZES`, ie `{"listing": 20}`.
+
+    Example response:
+    ```json
+    [
+        {"name": "provisioning", "size": 10, "active": 2, "queued": 0, "completed": 14},
+        {"name": "listing", "size": 10, "active": 10, "queued": 3, "completed": 1234},
+        {"name": "lookup", "size": 20, "active": 1, "queued": 0, "completed": 5678}
+    ]
+    ```
+
+    A growing `queued` count means calls wait for a free thread of that bulkhead.
+    """,
+)
+async def get_bulkhead_stats(request: Request) -> list[BulkheadStats]:
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return [bulkhead.stats() for bulkhead in bulkheads.all()]
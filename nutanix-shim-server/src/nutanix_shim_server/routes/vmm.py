@@ -1,17 +1,36 @@
 import logging
 from functools import wraps
-
-from fastapi import APIRouter, HTTPException, Request
-
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from nutanix_shim_server.bulkheads import Bulkheads
+from nutanix_shim_server.cache import InventoryCache
+from nutanix_shim_server.inventory import Inventory
+from nutanix_shim_server.jobs import Job, JobManager
+from nutanix_shim_server.responses import (
+    FastJSONResponse,
+    PageRequest,
+    cached_response,
+    json_response,
+    ndjson_response,
+    page_request,
+    page_response,
+)
 from nutanix_shim_server.vmm import (
+    BulkPowerStateChangeRequest,
     ImageMetadata,
     PowerStateChangeRequest,
     VirtualMachineMgmt,
     VmDetailsMetadata,
     VmListMetadata,
     VmMetadata,
+    VmPowerActionResult,
     VmPowerStateResponse,
     VmProvisionRequest,
+    VmProvisionResult,
 )
 
 logger = logging.getLogger(__name__)
@@ -27,9 +46,9 @@ def handle_vm_not_found(func):
     """
 
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    async def wrapper(*args, **kwargs):
         try:
-            return func(*args, **kwargs)
+            return await func(*args, **kwargs)
         except Exception as e:
             if hasattr(e, "status") and e.status == 404:
                 vm_id = kwargs.get("vm_id", "unknown")
@@ -45,10 +64,58 @@ def handle_vm_not_found(func):
 @router.get(
     "/list-images",
     response_model=list[ImageMetadata],
+    description="""
+    Returns a list of all available images in the Nutanix environment.
+
+    The name prefix filter is passed on to Nutanix, the cluster filter is
+    applied by the shim as Nutanix can't filter images on their placement.
+
+    Set `stream=true` to receive newline-delimited JSON (`application/x-ndjson`),
+    one image per line, written out page by page as they arrive from Nutanix.
+
+    Unless streamed, the response is served from the shim's inventory (or its
+    inventory cache while the inventory sync is disabled) and the `Age` header
+    gives the number of seconds since it was synced from Nutanix.
+
+    Such responses carry an `ETag`, send it as `If-None-Match` to get an empty
+    `304 Not Modified` while the data is unchanged.
+
+    Pass `limit` (at most 100) to get one page of images, then the `X-Next-Cursor`
+    response header as `cursor` for the next page, until it is left out. A cursor
+    keeps the page size it was made with, so leave `limit` out or unchanged. The
+    `X-Total-Count` header gives the number of matching images. Streamed
+    responses are not paginated.
+    """,
 )
-def list_clusters(request: Request) -> list[ImageMetadata]:
+async def list_clusters(
+    request: Request,
+    cluster_ext_id: None | str = Query(
+        None, description="Only images placed on the cluster with this external ID"
+    ),
+    name_prefix: None | str = Query(
+        None, description="Only images with a name starting with this prefix"
+    ),
+    stream: bool = Query(False, description="Stream images as newline-delimited JSON"),
+    page: None | PageRequest = Depends(page_request),
+) -> Response:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.list_images()
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    if stream:
+        return ndjson_response(
+            bulkheads.listing.iterate(api.iter_images(cluster_ext_id, name_prefix))
+        )
+    inventory: Inventory = request.app.state.inventory
+    if (synced := inventory.images(cluster_ext_id, name_prefix)) is not None:
+        return cached_response(request, synced, page)
+    cache: InventoryCache = request.app.state.cache
+    cached = await bulkheads.listing.run(
+        cache.get,
+        "images",
+        api.list_images,
+        cluster_ext_id=cluster_ext_id,
+        name_prefix=name_prefix,
+    )
+    return cached_response(request, cached, page)
 
 
 @router.get(
@@ -80,11 +147,69 @@ def list_clusters(request: Request) -> list[ImageMetadata]:
         }
     ]
     ```
+
+    Filter parameters are passed on to Nutanix, so only matching VMs are fetched.
+
+    Set `stream=true` to receive newline-delimited JSON (`application/x-ndjson`),
+    one VM per line, written out page by page as they arrive from Nutanix.
+
+    When the shim's inventory sync is enabled, unstreamed responses are served
+    from the inventory and the `Age` header gives the number of seconds since
+    it was synced from Nutanix.
+
+    Such responses carry an `ETag`, send it as `If-None-Match` to get an empty
+    `304 Not Modified` while the data is unchanged.
+
+    Pass `limit` (at most 100) to get one page of VMs, then the `X-Next-Cursor`
+    response header as `cursor` for the next page, until it is left out. A cursor
+    keeps the page size it was made with, so leave `limit` out or unchanged. The
+    `X-Total-Count` header gives the number of matching VMs. Unless served from the
+    inventory, a page takes a single request to Nutanix.
     """,
 )
-def list_vms(request: Request) -> list[VmListMetadata]:
+async def list_vms(
+    request: Request,
+    response: Response,
+    cluster_ext_id: None | str = Query(
+        None, description="Only VMs on the cluster with this external ID"
+    ),
+    power_state: None | Literal["ON", "OFF", "PAUSED", "UNDETERMINED"] = Query(
+        None, description="Only VMs in this power state"
+    ),
+    name_prefix: None | str = Query(
+        None, description="Only VMs with a name starting with this prefix"
+    ),
+    stream: bool = Query(False, description="Stream VMs as newline-delimited JSON"),
+    page: None | PageRequest = Depends(page_request),
+) -> Response:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.list_vms()
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    if stream:
+        return ndjson_response(
+            bulkheads.listing.iterate(
+                api.iter_vms(cluster_ext_id, power_state, name_prefix)
+            )
+        )
+    inventory: Inventory = request.app.state.inventory
+    if (synced := inventory.vms(cluster_ext_id, power_state, name_prefix)) is not None:
+        return cached_response(request, synced, page)
+    if page is not None:
+        try:
+            vms_page = await bulkheads.listing.run(
+                api.list_vms_page,
+                page.offset,
+                page.limit,
+                cluster_ext_id,
+                power_state,
+                name_prefix,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return page_response(response, vms_page)
+    vms = await bulkheads.listing.run(
+        api.list_vms, cluster_ext_id, power_state, name_prefix
+    )
+    return json_response(response, vms)
 
 
 @router.get(
@@ -118,15 +243,17 @@ def list_vms(request: Request) -> list[VmListMetadata]:
     """,
 )
 @handle_vm_not_found
-def get_vm_details(request: Request, vm_id: str) -> VmDetailsMetadata:
+async def get_vm_details(request: Request, vm_id: str) -> VmDetailsMetadata:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.get_vm_details(vm_id)
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.lookup.run(api.get_vm_details, vm_id)
 
 
 @router.post(
     "/provision-vm",
     response_model=VmMetadata,
     status_code=201,
+    responses={202: {"model": Job, "description": "Provisioning job accepted"}},
     summary="Provision a new virtual machine",
     description="""
     Provisions a new VM using network-based configuration (not image-based).
@@ -141,7 +268,8 @@ def get_vm_details(request: Request, vm_id: str) -> VmDetailsMetadata:
 
     Power-on behavior:
     - If `power_on` is true (default), the VM will be powered on after creation
-    - The endpoint will wait up to 60 seconds to verify the VM reaches ON state
+    - The endpoint will wait for the VM to reach ON state within `timeout_seconds`
+      (default 180) of the request, shared with waiting for the VM creation itself
     - If power-on fails or times out, the VM will be automatically deleted and an error returned
     - If `power_on` is false, the VM will remain off after creation
 
@@ -163,14 +291,159 @@ def get_vm_details(request: Request, vm_id: str) -> VmDetailsMetadata:
 
     Returns the VM metadata including the external ID of the created VM.
 
+    Set `async=true` to return immediately with `202 Accepted` and a job, the
+    provisioning then continues in the background. Poll `GET /api/v1/vmm/jobs/{id}`
+    (also given in the `Location` header) for progress, the job's `result` is the
+    VM metadata once it has succeeded.
+
     Errors:
     - 400: Invalid request parameters
     - 500: VM creation failed, or power-on failed (VM will be deleted automatically)
     """,
 )
-def provision_vm(request: Request, vm_request: VmProvisionRequest) -> VmMetadata:
+async def provision_vm(
+    request: Request,
+    vm_request: VmProvisionRequest,
+    run_async: bool = Query(
+        False, alias="async", description="Provision in a background job"
+    ),
+) -> VmMetadata | JSONResponse:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.provision_vm(vm_request)
+    if run_async:
+        jobs: JobManager = request.app.state.jobs
+        job = jobs.submit(
+            "provision-vm", lambda progress: api.provision_vm(vm_request, progress)
+        )
+        return JSONResponse(
+            status_code=202,
+            content=jsonable_encoder(job),
+            headers={"Location": request.url_for("get_job", job_id=job.id).path},
+        )
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.provisioning.run(api.provision_vm, vm_request)
+
+
+@router.post(
+    "/provision-vms",
+    response_model=list[VmProvisionResult],
+    responses={202: {"model": Job, "description": "Provisioning job accepted"}},
+    summary="Provision several virtual machines",
+    description="""
+    Provisions a batch of VMs concurrently, each as by `POST /api/v1/vmm/provision-vm`.
+
+    At most `NUTANIX_PROVISION_CLUSTER_CONCURRENCY` VMs (default 5) are provisioned
+    at a time per cluster, the others wait for a free slot before their
+    `timeout_seconds` starts. This limit is shared with single VM provisioning.
+
+    Returns one result per requested VM, in request order, holding either the
+    VM metadata or the error which made its provisioning fail. VMs which failed
+    to power on are deleted, and don't affect the other VMs of the batch.
+
+    Example response:
+    ```json
+    [
+        {"name": "my-vm-01", "vm": {"ext_id": "a1b2c3d4-...", ...}, "error": null},
+        {"name": "my-vm-02", "vm": null, "error": "VM creation task failed: ..."}
+    ]
+    ```
+
+    Set `async=true` to return immediately with `202 Accepted` and a job, the
+    job's `result` is the list of results once all VMs are done.
+
+    Errors:
+    - 400: No VMs requested
+    """,
+)
+async def provision_vms(
+    request: Request,
+    vm_requests: list[VmProvisionRequest],
+    run_async: bool = Query(
+        False, alias="async", description="Provision in a background job"
+    ),
+) -> list[VmProvisionResult] | JSONResponse:
+    if not vm_requests:
+        raise HTTPException(status_code=400, detail="No VMs to provision")
+    api: VirtualMachineMgmt = request.app.state.vmm
+    if run_async:
+        jobs: JobManager = request.app.state.jobs
+        job = jobs.submit(
+            "provision-vms", lambda progress: api.provision_vms(vm_requests, progress)
+        )
+        return JSONResponse(
+            status_code=202,
+            content=jsonable_encoder(job),
+            headers={"Location": request.url_for("get_job", job_id=job.id).path},
+        )
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.provisioning.run(api.provision_vms, vm_requests)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=Job,
+    summary="Get background job status",
+    description="""
+    Returns the state and progress of a background job, ie one started with
+    `POST /api/v1/vmm/provision-vm?async=true` or `POST /api/v1/vmm/provision-vms?async=true`.
+
+    States:
+    - **PENDING**: Accepted, waiting for a free worker
+    - **RUNNING**: In progress, `progress` describes the current step
+    - **SUCCEEDED**: Done, `result` holds the outcome
+    - **FAILED**: Done, `error` says what went wrong
+
+    Errors:
+    - 404: No job with this ID (unknown, or expired)
+    """,
+)
+async def get_job(request: Request, job_id: str) -> Job:
+    jobs: JobManager = request.app.state.jobs
+    if job := jobs.get(job_id):
+        return job
+    raise HTTPException(status_code=404, detail=f"Job with ID '{job_id}' not found")
+
+
+@router.get(
+    "/power-states",
+    response_model=list[VmPowerStateResponse],
+    summary="Get the power state of many VMs",
+    description="""
+    Returns the current power state of many VMs at once, from a single
+    filtered VM listing instead of fetching each VM.
+
+    Give the VMs as `ids`, either repeated (`?ids=a&ids=b`) or comma separated
+    (`?ids=a,b`), and/or `cluster_ext_id` for the VMs of a cluster. Without
+    either, the power state of every VM is returned. Unknown VMs are left out.
+
+    Example response:
+    ```json
+    [
+        {
+            "ext_id": "a1b2c3d4-e5f6-7890-abcd-ef1234567890",
+            "name": "my-vm-01",
+            "power_state": "ON"
+        }
+    ]
+    ```
+    """,
+)
+async def get_vm_power_states(
+    request: Request,
+    response: Response,
+    ids: None | list[str] = Query(None, description="External IDs of the VMs"),
+    cluster_ext_id: None | str = Query(
+        None, description="Only VMs on the cluster with this external ID"
+    ),
+) -> FastJSONResponse:
+    api: VirtualMachineMgmt = request.app.state.vmm
+    vm_ext_ids = None
+    if ids is not None:
+        vm_ext_ids = [i for value in ids for i in value.split(",") if i]
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    power_states = await bulkheads.listing.run(
+        api.get_vm_power_states, vm_ext_ids, cluster_ext_id
+    )
+    return json_response(response, power_states)
 
 
 @router.get(
@@ -197,9 +470,10 @@ def provision_vm(request: Request, vm_request: VmProvisionRequest) -> VmMetadata
     """,
 )
 @handle_vm_not_found
-def get_vm_power_state(request: Request, vm_id: str) -> VmPowerStateResponse:
+async def get_vm_power_state(request: Request, vm_id: str) -> VmPowerStateResponse:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.get_vm_power_state(vm_id)
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.lookup.run(api.get_vm_power_state, vm_id)
 
 
 @router.post(
@@ -230,11 +504,66 @@ def get_vm_power_state(request: Request, vm_id: str) -> VmPowerStateResponse:
     """,
 )
 @handle_vm_not_found
-def set_vm_power_state(
+async def set_vm_power_state(
     request: Request, vm_id: str, power_request: PowerStateChangeRequest
 ) -> VmPowerStateResponse:
     api: VirtualMachineMgmt = request.app.state.vmm
-    return api.set_vm_power_state(vm_id, power_request.action)
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.lookup.run(
+        api.set_vm_power_state, vm_id, power_request.action
+    )
+
+
+@router.post(
+    "/power-state",
+    response_model=list[VmPowerActionResult],
+    summary="Change the power state of several VMs",
+    description="""
+    Performs one power action (see `POST /api/v1/vmm/vms/{vm_id}/power-state`)
+    on a list of VMs.
+
+    The actions run concurrently, at most `NUTANIX_POWER_ACTION_CONCURRENCY`
+    (default 10) at a time. With `use_batch_api` they are instead submitted to
+    Nutanix as a single Prism batch; Prism doesn't say which operations of a
+    failed batch went wrong, so the batch error is then reported for every VM.
+
+    Example request:
+    ```json
+    {
+        "ext_ids": ["a1b2c3d4-e5f6-7890-abcd-ef1234567890", "b2c3d4e5-f6a7-8901-bcde-f12345678901"],
+        "action": "SHUTDOWN",
+        "use_batch_api": false
+    }
+    ```
+
+    Returns one result per VM with its power state after the actions were
+    submitted (`null` if the VM wasn't found) and the error, if its action failed.
+
+    Example response:
+    ```json
+    [
+        {"ext_id": "a1b2c3d4-e5f6-7890-abcd-ef1234567890", "power_state": "OFF", "error": null},
+        {"ext_id": "b2c3d4e5-f6a7-8901-bcde-f12345678901", "power_state": null, "error": "(404) ..."}
+    ]
+    ```
+
+    Errors:
+    - 400: No VMs given
+    """,
+)
+async def set_vm_power_states(
+    request: Request, power_request: BulkPowerStateChangeRequest
+) -> list[VmPowerActionResult]:
+    if not power_request.ext_ids:
+        raise HTTPException(status_code=400, detail="No VMs given")
+    api: VirtualMachineMgmt = request.app.state.vmm
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    return await bulkheads.provisioning.run(
+        api.set_vm_power_states,
+        power_request.ext_ids,
+        power_request.action,
+        power_request.use_batch_api,
+    )
 
 
 @router.delete(
@@ -253,6 +582,7 @@ def set_vm_power_state(
     """,
 )
 @handle_vm_not_found
-def delete_vm(request: Request, vm_id: str) -> None:
+async def delete_vm(request: Request, vm_id: str) -> None:
     api: VirtualMachineMgmt = request.app.state.vmm
-    api.delete_vm(vm_id)
+    bulkheads: Bulkheads = request.app.state.bulkheads
+    await bulkheads.lookup.run(api.delete_vm, vm_id)
@@ -7,11 +7,22 @@ from dataclasses import dataclass
 
 from fastapi import FastAPI
 
+from nutanix_shim_server.bulkheads import Bulkheads
+from nutanix_shim_server.cache import InventoryCache
+from nutanix_shim_server.clients import NutanixClients
 from nutanix_shim_server.clustermgmt import ClusterMgmt
+from nutanix_shim_server.inventory import Inventory
+from nutanix_shim_server.jobs import JobManager
 from nutanix_shim_server.networking import Networking
+from nutanix_shim_server.responses import RenderedCache
 from nutanix_shim_server.routes.clustermgmt import router as clustermgmt_router
+from nutanix_shim_server.routes.metrics import record_request
+from nutanix_shim_server.routes.metrics import router as metrics_router
 from nutanix_shim_server.routes.networking import router as networking_router
+from nutanix_shim_server.routes.status import router as status_router
 from nutanix_shim_server.routes.vmm import router as vmm_router
+from nutanix_shim_server.snapshot import Snapshot
+from nutanix_shim_server.tracing import TraceExporter, trace_request
 from nutanix_shim_server.vmm import VirtualMachineMgmt
 
 
@@ -24,6 +35,24 @@ class Context:
     nutanix_host_port: int
     nutanix_client_certificate_file: None | str
     nutanix_root_ca_certificate_file: None | str
+    nutanix_pagination_concurrency: int
+    nutanix_cache_ttls: dict[str, float]
+    nutanix_cache_max_entries: int
+    nutanix_job_workers: int
+    nutanix_provision_cluster_concurrency: int
+    nutanix_power_action_concurrency: int
+    nutanix_cluster_stats_concurrency: int
+    nutanix_bulkhead_sizes: dict[str, int]
+    nutanix_connection_pool_size: int
+    nutanix_raw_json: bool
+    nutanix_response_gzip: bool
+    nutanix_response_cache_max_bytes: int
+    nutanix_inventory_sync_interval: float
+    nutanix_inventory_reconcile_interval: float
+    nutanix_snapshot_path: None | str
+    nutanix_snapshot_interval: float
+    nutanix_snapshot_max_age: float
+    nutanix_trace_path: None | str
 
     _vars = __annotations__
 
@@ -37,6 +66,24 @@ class Context:
             nutanix_host_port=cls.get_nutanix_host_port(),
             nutanix_client_certificate_file=cls.get_nutanix_client_certificate_file(),
             nutanix_root_ca_certificate_file=cls.get_nutanix_root_ca_certificate_file(),
+            nutanix_pagination_concurrency=cls.get_nutanix_pagination_concurrency(),
+            nutanix_cache_ttls=cls.get_nutanix_cache_ttls(),
+            nutanix_cache_max_entries=cls.get_nutanix_cache_max_entries(),
+            nutanix_job_workers=cls.get_nutanix_job_workers(),
+            nutanix_provision_cluster_concurrency=cls.get_nutanix_provision_cluster_concurrency(),
+            nutanix_power_action_concurrency=cls.get_nutanix_power_action_concurrency(),
+            nutanix_cluster_stats_concurrency=cls.get_nutanix_cluster_stats_concurrency(),
+            nutanix_bulkhead_sizes=cls.get_nutanix_bulkhead_sizes(),
+            nutanix_connection_pool_size=cls.get_nutanix_connection_pool_size(),
+            nutanix_raw_json=cls.get_nutanix_raw_json(),
+            nutanix_response_gzip=cls.get_nutanix_response_gzip(),
+            nutanix_response_cache_max_bytes=cls.get_nutanix_response_cache_max_bytes(),
+            nutanix_inventory_sync_interval=cls.get_nutanix_inventory_sync_interval(),
+            nutanix_inventory_reconcile_interval=cls.get_nutanix_inventory_reconcile_interval(),
+            nutanix_snapshot_path=cls.get_nutanix_snapshot_path(),
+            nutanix_snapshot_interval=cls.get_nutanix_snapshot_interval(),
+            nutanix_snapshot_max_age=cls.get_nutanix_snapshot_max_age(),
+            nutanix_trace_path=cls.get_nutanix_trace_path(),
         )
 
     @staticmethod
@@ -78,17 +125,138 @@ class Context:
     def get_nutanix_root_ca_certificate_file() -> None | str:
         return os.getenv("NUTANIX_ROOT_CA_CERTIFICATE_FILE")
 
+    @staticmethod
+    def get_nutanix_pagination_concurrency() -> int:
+        return int(os.environ.get("NUTANIX_PAGINATION_CONCURRENCY", 4))
+
+    @staticmethod
+    def get_nutanix_cache_ttls() -> dict[str, float]:
+        ttls = {
+            "clusters": 600,
+            "storage_containers": 300,
+            "subnets": 300,
+            "images": 300,
+            "host_capacity": 3600,
+        }
+        ttls.update(ast.literal_eval(os.environ.get("NUTANIX_CACHE_TTLS", "{}")))
+        return ttls
+
+    @staticmethod
+    def get_nutanix_cache_max_entries() -> int:
+        return int(os.environ.get("NUTANIX_CACHE_MAX_ENTRIES", 256))
+
+    @staticmethod
+    def get_nutanix_job_workers() -> int:
+        return int(os.environ.get("NUTANIX_JOB_WORKERS", 10))
+
+    @staticmethod
+    def get_nutanix_provision_cluster_concurrency() -> int:
+        return int(os.environ.get("NUTANIX_PROVISION_CLUSTER_CONCURRENCY", 5))
+
+    @staticmethod
+    def get_nutanix_power_action_concurrency() -> int:
+        return int(os.environ.get("NUTANIX_POWER_ACTION_CONCURRENCY", 10))
+
+    @staticmethod
+    def get_nutanix_cluster_stats_concurrency() -> int:
+        return int(os.environ.get("NUTANIX_CLUSTER_STATS_CONCURRENCY", 6))
+
+    @staticmethod
+    def get_nutanix_bulkhead_sizes() -> dict[str, int]:
+        sizes = {
+            "provisioning": 10,
+            "listing": 10,
+            "lookup": 20,
+        }
+        sizes.update(ast.literal_eval(os.environ.get("NUTANIX_BULKHEAD_SIZES", "{}")))
+        return sizes
+
+    @staticmethod
+    def get_nutanix_connection_pool_size() -> int:
+        # One connection for each thread making requests to Nutanix
+        default = (
+            sum(Context.get_nutanix_bulkhead_sizes().values())
+            + Context.get_nutanix_job_workers()
+        )
+        return int(os.environ.get("NUTANIX_CONNECTION_POOL_SIZE", default))
+
+    @staticmethod
+    def get_nutanix_raw_json() -> bool:
+        # Decode VM, image and subnet listings straight from JSON, without SDK models
+        return ast.literal_eval(os.environ.get("NUTANIX_RAW_JSON", "False"))
+
+    @staticmethod
+    def get_nutanix_response_gzip() -> bool:
+        # Gzip cached list responses for clients accepting it
+        return ast.literal_eval(os.environ.get("NUTANIX_RESPONSE_GZIP", "True"))
+
+    @staticmethod
+    def get_nutanix_response_cache_max_bytes() -> int:
+        # Total size of the encoded (and gzipped) list responses kept, 128 MiB
+        return int(os.environ.get("NUTANIX_RESPONSE_CACHE_MAX_BYTES", 128 * 2**20))
+
+    @staticmethod
+    def get_nutanix_inventory_sync_interval() -> float:
+        # Seconds between syncs of the in-memory inventory, disabled if zero
+        return float(os.environ.get("NUTANIX_INVENTORY_SYNC_INTERVAL", 0))
+
+    @staticmethod
+    def get_nutanix_inventory_reconcile_interval() -> float:
+        # Seconds between full reloads of the inventory, see `Inventory`
+        return float(os.environ.get("NUTANIX_INVENTORY_RECONCILE_INTERVAL", 900))
+
+    @staticmethod
+    def get_nutanix_snapshot_path() -> None | str:
+        # SQLite file the inventory is saved to and restored from on restart
+        return os.getenv("NUTANIX_SNAPSHOT_PATH")
+
+    @staticmethod
+    def get_nutanix_snapshot_interval() -> float:
+        return float(os.environ.get("NUTANIX_SNAPSHOT_INTERVAL", 300))
+
+    @staticmethod
+    def get_nutanix_snapshot_max_age() -> float:
+        # Older entries of a snapshot are not restored
+        return float(os.environ.get("NUTANIX_SNAPSHOT_MAX_AGE", 86400))
+
+    @staticmethod
+    def get_nutanix_trace_path() -> None | str:
+        # File the spans of each request are appended to as OTLP/JSON lines
+        return os.getenv("NUTANIX_TRACE_PATH")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     ctx = Context.from_env()
-    app.state.clustermgmt = ClusterMgmt(ctx)
-    app.state.vmm = VirtualMachineMgmt(ctx)
-    app.state.networking = Networking(ctx)
+    clients = NutanixClients(ctx)
+    app.state.cache = InventoryCache(ctx)
+    app.state.rendered = RenderedCache(ctx)
+    app.state.clustermgmt = ClusterMgmt(ctx, clients, app.state.cache)
+    app.state.vmm = VirtualMachineMgmt(ctx, clients)
+    app.state.networking = Networking(ctx, clients)
+    app.state.jobs = JobManager(ctx)
+    app.state.bulkheads = Bulkheads(ctx)
+    app.state.trace_exporter = TraceExporter(ctx)
+    app.state.inventory = Inventory(ctx, app.state.vmm, app.state.networking)
+    snapshot = Snapshot(ctx, app.state.cache, app.state.inventory)
+    snapshot.load()
+    app.state.inventory.start()
+    snapshot.start()
     yield
+    app.state.inventory.close()
+    snapshot.close()
+    app.state.bulkheads.close()
+    app.state.jobs.close()
+    app.state.trace_exporter.close()
+    app.state.cache.close()
+    clients.close()
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(clustermgmt_router)
 app.include_router(vmm_router)
 app.include_router(networking_router)
+app.include_router(status_router)
+app.include_router(metrics_router)
+app.middleware("http")(record_request)
+app.middleware("http")(trace_request)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls into a single execution.
+
+    While a call for a key is in flight, further calls for the same key
+    don't execute again but wait for, and share, the result (or exception)
+    of the one in flight. Once it is done the next call executes anew, so
+    nothing is cached beyond the duration of a call.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()  # type: ignore
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)  # type: ignore
+            raise
+        else:
+            future.set_result(result)  # type: ignore
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def single_flight(method: F) -> F:
+    """
+    Decorator coalescing identical concurrent calls of a read method.
+
+    Calls on the same instance with equal arguments share one execution, see
+    `SingleFlight`. All callers get the same result object, so it must not be
+    modified. Calls with unhashable arguments are not coalesced.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, _freeze(args), _freeze(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        group = self.__dict__.setdefault("_single_flight", SingleFlight())
+        return group.do(key, method, self, *args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+def _freeze(value):
+    """Make lists (ie of ext_ids) usable as part of a key"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
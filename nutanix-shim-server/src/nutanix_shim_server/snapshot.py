@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from nutanix_shim_server import server
+from nutanix_shim_server.cache import Cached, InventoryCache
+from nutanix_shim_server.inventory import Inventory
+
+logger = logging.getLogger(__name__)
+
+# Stores of the snapshot, the entries of each are keyed within it
+CACHE = "cache"
+INVENTORY = "inventory"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    store TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (store, key)
+)
+"""
+
+
+class Snapshot:
+    """
+    On-disk snapshot of the inventory cache and the synced inventory.
+
+    The snapshot is saved every `nutanix_snapshot_interval` seconds and on
+    shutdown to the SQLite database at `nutanix_snapshot_path`, and loaded
+    back on startup. A restarted shim thus answers listings right away from
+    the snapshot, and, as the loaded entries keep the time they were fetched
+    from Nutanix, refreshes them in the background as it would any stale
+    entry. Entries older than `nutanix_snapshot_max_age` seconds are not
+    loaded.
+
+    Values are stored as JSON, and only the response models of the shim are
+    restored from it. Without a snapshot path nothing is saved or loaded.
+    """
+
+    def __init__(
+        self, ctx: server.Context, cache: InventoryCache, inventory: Inventory
+    ):
+        self.path = ctx.nutanix_snapshot_path
+        self.interval = ctx.nutanix_snapshot_interval
+        self.max_age = ctx.nutanix_snapshot_max_age
+        self.cache = cache
+        self.inventory = inventory
+        self._stop = threading.Event()
+        self._thread: None | threading.Thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def load(self) -> None:
+        """Restore the cache and inventory from the snapshot, if there is one"""
+        if not self.enabled or not os.path.exists(self.path):  # type: ignore
+            return
+        try:
+            with self._lock, self._connect() as db:
+                rows = db.execute(
+                    "SELECT store, key, fetched_at, value FROM entries "
+                    "WHERE fetched_at > ?",
+                    (time.time() - self.max_age,),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to load snapshot {self.path}: {e}")
+            return
+
+        cache_entries, inventory_entries = [], {}
+        for store, key, fetched_at, value in rows:
+            try:
+                cached = Cached(value=_decode(json.loads(value)), fetched_at=fetched_at)
+            except (KeyError, ValueError, TypeError, AttributeError, ImportError) as e:
+                # ie written by a version of the shim with other models
+                logger.warning(f"Skipping snapshot entry {store} {key}: {e}")
+                continue
+            if store == CACHE:
+                cache_entries.append((_tuples(json.loads(key)), cached))
+            elif store == INVENTORY:
+                inventory_entries[key] = cached
+        self.cache.load(cache_entries)
+        self.inventory.load(inventory_entries)
+        logger.info(f"Loaded {len(rows)} entries from snapshot {self.path}")
+
+    def save(self) -> None:
+        """Replace the snapshot with the current cache and inventory"""
+        if not self.enabled:
+            return
+        rows = [
+            (
+                CACHE,
+                json.dumps(key),
+                cached.fetched_at,
+                json.dumps(_encode(cached.value)),
+            )
+            for key, cached in self.cache.dump()
+        ] + [
+            (INVENTORY, name, cached.fetched_at, json.dumps(_encode(cached.value)))
+            for name, cached in self.inventory.dump().items()
+        ]
+        try:
+            with self._lock, self._connect() as db:
+                db.execute("DELETE FROM entries")
+                db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to save snapshot {self.path}: {e}")
+
+    def start(self) -> None:
+        """Start saving the snapshot periodically, if enabled"""
+        if not self.enabled or self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="snapshot", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop saving periodically, and save one last time"""
+        self._stop.set()
+        self.save()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.save()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Connection to the snapshot, committing on success"""
+        db = sqlite3.connect(self.path)  # type: ignore
+        try:
+            with db:
+                db.execute(_SCHEMA)
+                yield db
+        finally:
+            db.close()
+
+
+def _encode(value: Any) -> Any:
+    """Convert response models to JSON, tagging dataclasses and datetimes"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        cls = type(value)
+        return {
+            "__dataclass__": f"{cls.__module__}:{cls.__qualname__}",
+            "fields": {
+                field.name: _encode(getattr(value, field.name))
+                for field in dataclasses.fields(value)
+            },
+        }
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {"__dict__": {key: _encode(item) for key, item in value.items()}}
+    return value
+
+
+def _decode(value: Any) -> Any:
+    """Reverse `_encode`, only instantiating dataclasses of the shim"""
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    if "__dict__" in value:
+        return {key: _decode(item) for key, item in value["__dict__"].items()}
+
+    module_name, _, qualname = value["__dataclass__"].partition(":")
+    if not module_name.startswith(f"{__package__}."):
+        raise ValueError(f"Not a model of the shim: {value['__dataclass__']}")
+    cls = getattr(importlib.import_module(module_name), qualname)
+    if not dataclasses.is_dataclass(cls):
+        raise ValueError(f"Not a model of the shim: {value['__dataclass__']}")
+    return cls(**{name: _decode(item) for name, item in value["fields"].items()})
+
+
+def _tuples(value: Any) -> Any:
+    """Turn the lists of a JSON decoded cache key back into tuples"""
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+    return value
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterator
+
+import ntnx_prism_py_client as prism
+
+from nutanix_shim_server import metrics
+from nutanix_shim_server.polling import Backoff, PollResult
+from nutanix_shim_server.utils import odata_str, paginate
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_TASK_STATUSES = frozenset({"SUCCEEDED", "FAILED", "CANCELED"})
+
+
+@dataclasses.dataclass
+class _Watch:
+    futures: list[Future[PollResult[prism.Task]]]
+    intervals: Iterator[float]
+    started: float
+    next_poll: float
+    polls: int = 0
+
+
+class TaskWatcher:
+    """
+    Shared watcher resolving Prism tasks for any number of concurrent waiters.
+
+    Instead of each waiter polling `get_task_by_id` for its own task, waiters
+    register the task's ext_id and get a future. A single background thread
+    resolves outstanding tasks with batched `list_tasks` calls filtered on
+    their ext_ids, and completes each future once its task reaches a terminal
+    status.
+
+    Each task is polled on its own `Backoff` schedule, so quick tasks are seen
+    quickly and long ones are polled less and less. When the first task comes
+    due, all tasks due within the next `coalesce` seconds are fetched in the
+    same batch, which bounds the upstream request rate no matter how many
+    tasks are in flight.
+
+    The thread only runs while there are tasks to watch.
+    """
+
+    def __init__(
+        self,
+        list_tasks: Callable[..., object],
+        backoff: Backoff = Backoff(initial=0.5, factor=1.5, maximum=5.0),
+        coalesce: float = 1.0,
+        batch_size: int = 25,
+    ):
+        self.list_tasks = list_tasks
+        self.backoff = backoff
+        self.coalesce = coalesce
+        self.batch_size = batch_size
+        self._watched: dict[str, _Watch] = {}
+        self._wakeup = threading.Condition()
+        self._thread: None | threading.Thread = None
+
+    def watch(self, task_ext_id: str) -> Future[PollResult[prism.Task]]:
+        """
+        Register a task, returning a future completed once the task ends.
+
+        The future's result holds the `prism.Task`, which may still have FAILED
+        or been CANCELED, and how many polls it took. Cancel the future to stop
+        waiting on it.
+        """
+        future: Future[PollResult[prism.Task]] = Future()
+        now = time.monotonic()
+        with self._wakeup:
+            if watch := self._watched.get(task_ext_id):
+                watch.futures.append(future)
+            else:
+                intervals = self.backoff.intervals()
+                self._watched[task_ext_id] = _Watch(
+                    futures=[future],
+                    intervals=intervals,
+                    started=now,
+                    next_poll=now + next(intervals),
+                )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="task-watcher", daemon=True
+                )
+                self._thread.start()
+            self._wakeup.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                self._drop_cancelled()
+                if not self._watched:
+                    self._thread = None
+                    return
+
+                now = time.monotonic()
+                next_poll = min(w.next_poll for w in self._watched.values())
+                if next_poll > now:
+                    # Woken early when a new task is registered, to reschedule
+                    self._wakeup.wait(next_poll - now)
+                    continue
+
+                due = [
+                    task_ext_id
+                    for task_ext_id, watch in self._watched.items()
+                    if watch.next_poll <= now + self.coalesce
+                ]
+
+                for task_ext_id in due:
+                    watch = self._watched[task_ext_id]
+                    watch.polls += 1
+                    watch.next_poll = now + next(watch.intervals)
+
+            for start in range(0, len(due), self.batch_size):
+                self._poll(due[start : start + self.batch_size])
+
+    def _poll(self, task_ext_ids: list[str]) -> None:
+        """Fetch a batch of tasks, resolving the waiters of those which ended"""
+        task_filter = " or ".join(
+            f"extId eq {odata_str(task_ext_id)}" for task_ext_id in task_ext_ids
+        )
+        try:
+            tasks: list[prism.Task] = paginate(self.list_tasks, _filter=task_filter)  # type: ignore
+        except Exception as e:
+            # Waiters time out on their own, keep trying until then
+            metrics.TASK_POLLS.labels("error").inc()
+            logger.warning(f"Failed to poll {len(task_ext_ids)} tasks: {e}")
+            return
+        metrics.TASK_POLLS.labels("success").inc()
+
+        for task in tasks:
+            status = str(task.status) if task.status else "UNKNOWN"
+            if status not in TERMINAL_TASK_STATUSES:
+                continue
+            with self._wakeup:
+                watch = self._watched.pop(task.ext_id, None)  # type: ignore
+            if watch is None:
+                continue
+
+            result = PollResult(task, watch.polls, time.monotonic() - watch.started)
+            metrics.TASK_WAIT_SECONDS.labels(status).observe(result.elapsed)
+            logger.info(
+                f"Task {task.ext_id} {status} after {result.polls} polls "
+                f"in {result.elapsed:.1f} seconds"
+            )
+            for future in watch.futures:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(result)
+
+    def _drop_cancelled(self) -> None:
+        for task_ext_id, watch in list(self._watched.items()):
+            watch.futures = [f for f in watch.futures if not f.cancelled()]
+            if not watch.futures:
+                del self._watched[task_ext_id]
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import contextvars
+import dataclasses
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from fastapi import Request, Response
+
+from nutanix_shim_server import server
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+# OTLP status code of a failed span
+STATUS_CODE_ERROR = 2
+
+# Steps of a request which are Nutanix API calls
+CLIENT_STEPS = frozenset({"upstream"})
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_STOP = object()
+
+
+@dataclasses.dataclass
+class Span:
+    """
+    A timed step of handling a request.
+
+    `step` is a short token saying what kind of work it was, ie "upstream"
+    for a Nutanix API call, and groups spans in the `Server-Timing` header.
+    `name` tells them apart, ie the API endpoint called.
+    """
+
+    step: str
+    name: str
+    span_id: str
+    parent_id: None | str
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict[str, str] = dataclasses.field(default_factory=dict)
+    error: bool = False
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """The spans of one request, added to from any thread handling it"""
+
+    def __init__(self, traceparent: None | str = None):
+        self.trace_id = os.urandom(16).hex()
+        self.parent_id: None | str = None
+        # Continue the trace of a caller sending a W3C `traceparent`
+        if traceparent and (match := _TRACEPARENT.match(traceparent.strip())):
+            self.trace_id, self.parent_id = match.groups()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self) -> str:
+        """
+        The spans as a `Server-Timing` header value, ie
+        `upstream;desc="GET /api/...";dur=812.3, convert;dur=1.2`.
+
+        Spans of the same step and name are summed, with their count in the
+        description. Concurrent spans overlap, so their sum can exceed the
+        duration of the request.
+        """
+        with self._lock:
+            spans = [span for span in self.spans if span.parent_id is not None]
+        totals: dict[tuple[str, str], list[float]] = {}
+        for span in spans:
+            totals.setdefault((span.step, span.name), []).append(span.duration_ms)
+
+        metrics = []
+        for (step, name), durations in totals.items():
+            desc = "" if name == step else name
+            if len(durations) > 1:
+                desc = f"{desc} ({len(durations)}x)".lstrip()
+            desc = desc.replace("\\", "\\\\").replace('"', '\\"')
+            desc = f';desc="{desc}"' if desc else ""
+            metrics.append(f"{step}{desc};dur={sum(durations):.1f}")
+        return ", ".join(metrics)
+
+    def to_otlp(self) -> dict:
+        """The trace as an OTLP/JSON `ExportTraceServiceRequest`"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            _attribute("service.name", "nutanix-shim-server")
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __package__},
+                            "spans": [self._otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _otlp_span(self, span: Span) -> dict:
+        if span.parent_id is None:
+            kind, parent_id = SPAN_KIND_SERVER, self.parent_id
+        else:
+            kind, parent_id = SPAN_KIND_INTERNAL, span.parent_id
+            if span.step in CLIENT_STEPS:
+                kind = SPAN_KIND_CLIENT
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": parent_id or "",
+            "name": span.name,
+            "kind": kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                _attribute(key, value)
+                for key, value in {"shim.step": span.step, **span.attributes}.items()
+            ],
+        }
+        if span.error:
+            otlp["status"] = {"code": STATUS_CODE_ERROR}
+        return otlp
+
+
+class TraceExporter:
+    """
+    Appends the traces of requests to a file, for analysis without a collector.
+
+    Each trace is written as one line of OTLP/JSON, the format of the
+    OpenTelemetry Collector's file exporter, so the file can be read by its
+    `otlpjsonfile` receiver or loaded line by line with any JSON parser.
+    Traces are written by a background thread, and dropped if it falls more
+    than `max_queued` traces behind.
+    """
+
+    def __init__(self, ctx: server.Context, max_queued: int = 10_000):
+        self.path = ctx.nutanix_trace_path
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._thread: None | threading.Thread = None
+        if self.path:
+            self._thread = threading.Thread(
+                target=self._run, name="trace-exporter", daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def export(self, trace: Trace) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning(f"Dropping trace {trace.trace_id}, exporter is behind")
+
+    def close(self) -> None:
+        """Write the queued traces, and stop"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while (trace := self._queue.get()) is not _STOP:
+            try:
+                with open(self.path, "a") as f:  # type: ignore
+                    f.write(json.dumps(trace.to_otlp(), separators=(",", ":")))
+                    f.write("\n")
+            except OSError as e:
+                logger.warning(f"Failed to write trace to {self.path}: {e}")
+
+
+# Trace of the request being handled, and the innermost open span of it
+_trace: contextvars.ContextVar[None | Trace] = contextvars.ContextVar(
+    "trace", default=None
+)
+_parent: contextvars.ContextVar[None | str] = contextvars.ContextVar(
+    "parent", default=None
+)
+
+
+@contextmanager
+def span(step: str, name: None | str = None, **attributes: str) -> Iterator[None]:
+    """
+    Record the enclosed block as a span of the current request's trace.
+
+    Does nothing outside of a request, ie for the background inventory sync.
+
+    Parameters
+    ----------
+        step: Kind of work, a token like "upstream" or "convert"
+        name: What the work was on, defaults to `step`
+        attributes: Added to the span as string attributes
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+
+    current = Span(
+        step=step,
+        name=name or step,
+        span_id=os.urandom(8).hex(),
+        parent_id=_parent.get(),
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _parent.set(current.span_id)
+    try:
+        yield
+    except BaseException:
+        current.error = True
+        raise
+    finally:
+        _parent.reset(token)
+        current.end_ns = time.time_ns()
+        trace.add(current)
+
+
+def add_span(
+    step: str, start_ns: int, name: None | str = None, **attributes: str
+) -> None:
+    """Record a span which started at `start_ns` and ends now"""
+    if (trace := _trace.get()) is not None:
+        trace.add(
+            Span(
+                step=step,
+                name=name or step,
+                span_id=os.urandom(8).hex(),
+                parent_id=_parent.get(),
+                start_ns=start_ns,
+                end_ns=time.time_ns(),
+                attributes=attributes,
+            )
+        )
+
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Bind `fn` to a copy of the current context, ie for `executor.submit`.
+
+    Spans recorded by `fn` on another thread then belong to the request
+    which submitted it. Make a new one for every submission, as a context
+    can only be entered by one thread at a time.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+async def trace_request(request: Request, call_next) -> Response:
+    """
+    Middleware tracing each request, and adding a `Server-Timing` header.
+
+    The header holds the spans done by the time the response starts, so for
+    streamed responses it misses the steps producing the body. Traces are
+    exported once the response has started, if a `TraceExporter` is set up.
+    """
+    trace = Trace(request.headers.get("traceparent"))
+    trace_token = _trace.set(trace)
+    parent_token = _parent.set(None)
+    root = Span(
+        step="total",
+        name=request.method,
+        span_id=os.urandom(8).hex(),
+        parent_id=None,
+        start_ns=time.time_ns(),
+        attributes={"http.request.method": request.method},
+    )
+    _parent.set(root.span_id)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        root.error = True
+        raise
+    else:
+        root.attributes["http.response.status_code"] = str(response.status_code)
+        root.error = response.status_code >= 500
+    finally:
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+        root.end_ns = time.time_ns()
+        if route := getattr(request.scope.get("route"), "path", None):
+            root.name = f"{request.method} {route}"
+            root.attributes["http.route"] = route
+        trace.add(root)
+        exporter: None | TraceExporter = getattr(
+            request.app.state, "trace_exporter", None
+        )
+        if exporter is not None:
+            exporter.export(trace)
+
+    timing = trace.server_timing()
+    timing = f"{timing}, " if timing else ""
+    response.headers["Server-Timing"] = f"{timing}total;dur={root.duration_ms:.1f}"
+    return response
+
+
+def _attribute(key: str, value: str) -> dict:
+    return {"key": key, "value": {"stringValue": value}}
@@ -1,14 +1,25 @@
-from typing import Callable, Concatenate, TypeVar
+import dataclasses
+import datetime
+import itertools
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Concatenate, Generic, Iterator, TypeVar
 
 from ntnx_vmm_py_client import ApiResponseMetadata
 
+from nutanix_shim_server import metrics, tracing
+
 ResponseType = TypeVar("ResponseType")
 Page = TypeVar("Page", bound="int")
 Kwargs = TypeVar("Kwargs", bound=dict)
 T = TypeVar("T")
 
 
-def paginate(op: Callable[Concatenate[...], ResponseType], **kwargs) -> list[object]:
+def paginate(
+    op: Callable[Concatenate[...], ResponseType], concurrency: int = 1, **kwargs
+) -> list[object]:
     """
     Paginate a Nutanix `list_*` method from an API.
 
@@ -21,37 +32,238 @@ def paginate(op: Callable[Concatenate[...], ResponseType], **kwargs) -> list[obj
     ----------
     op: callable
         The `list_*` method, ie vmm.VmApi(...).list_vms
+    concurrency: int
+        Maximum number of pages fetched in parallel, see `iter_pages`.
     kwargs:
         Any kwargs to pass to each call, will set the '_page' parameter in this call.
 
     Returns
     -------
     list[T]
-        Where T is the response.data item type.
+        Where T is the response.data item type, in page order.
+    """
+    return [item for page in iter_pages(op, concurrency, **kwargs) for item in page]
+
+
+def iter_pages(
+    op: Callable[Concatenate[...], ResponseType], concurrency: int = 1, **kwargs
+) -> Iterator[list[object]]:
+    """
+    Lazily paginate a Nutanix `list_*` method, yielding one page of items at a time.
+
+    With a `concurrency` above 1 the first page is fetched alone to learn
+    `total_available_results`, then the remaining pages are fetched on a
+    bounded thread pool. At most `concurrency` pages are in flight at once, so
+    a slow consumer holds back fetching instead of buffering the whole estate.
+    Falls back to walking the pages one by one if the total is not reported.
+
+    Parameters
+    ----------
+    op: callable
+        The `list_*` method, ie vmm.VmApi(...).list_vms
+    concurrency: int
+        Maximum number of pages fetched in parallel.
+    kwargs:
+        Any kwargs to pass to each call, will set the '_page' parameter in this call.
+
+    Yields
+    ------
+    list[T]
+        Where T is the response.data item type, in page order.
     """
-    page: int = 0
-    collection = []
     kwargs = kwargs if kwargs else {}
 
     if "_limit" not in kwargs:
         kwargs["_limit"] = 100
+    kwargs.pop("_page", None)
 
+    fetched = itertools.count()
+
+    def fetch(page: int):
+        next(fetched)
+        return op(**kwargs, _page=page)
+
+    try:
+        yield from _iter_pages(fetch, kwargs["_limit"], concurrency)
+    finally:
+        # Pages requested from Nutanix, including those of a stopped listing
+        pages = next(fetched)
+        metrics.LISTING_PAGES.labels(getattr(op, "__name__", "unknown")).observe(pages)
+
+
+def _iter_pages(
+    fetch: Callable[[int], ResponseType], limit: int, concurrency: int
+) -> Iterator[list[object]]:
+    resp = fetch(0)
+    if not resp.data:  # type: ignore
+        return
+    yield resp.data  # type: ignore
+    if _is_last_page(resp):
+        return
+
+    n_pages = _n_pages(resp, limit)
+    if concurrency > 1 and n_pages is not None:
+        if n_pages > 1:
+            yield from _iter_pages_concurrently(fetch, n_pages, concurrency)
+        return
+
+    page = 1
     while True:
-        kwargs["_page"] = page
-        resp = op(**kwargs)
+        resp = fetch(page)
 
         if resp.data:  # type: ignore
-            collection.extend(resp.data)  # type: ignore
+            yield resp.data  # type: ignore
         else:
             break
 
-        metadata: None | ApiResponseMetadata = resp.metadata  # type: ignore
-        if metadata:
-            links = {link.rel: link.href for link in metadata.links or []}
-            if not links or links.get("self") == links.get("last"):
-                break
-        else:
+        if _is_last_page(resp):
             break
 
         page += 1
-    return collection
+
+
+@dataclasses.dataclass(frozen=True)
+class ListPage(Generic[T]):
+    """Up to `limit` items at `offset` into all `total` matching items"""
+
+    items: list[T]
+    offset: int
+    limit: int
+    total: None | int
+
+    @property
+    def next_offset(self) -> None | int:
+        """Offset of the next page, None if this is the last one"""
+        end = self.offset + len(self.items)
+        if self.total is not None:
+            return end if end < self.total else None
+        return end if len(self.items) == self.limit else None
+
+    @classmethod
+    def of(cls, items: list[T], offset: int, limit: int) -> "ListPage[T]":
+        """Page of a list holding all matching items"""
+        return cls(
+            items=items[offset : offset + limit],
+            offset=offset,
+            limit=limit,
+            total=len(items),
+        )
+
+
+def fetch_page(
+    op: Callable[Concatenate[...], ResponseType], offset: int, limit: int, **kwargs
+) -> ListPage[object]:
+    """
+    Fetch a single page of a Nutanix `list_*` method.
+
+    Parameters
+    ----------
+    op: callable
+        The `list_*` method, ie vmm.VmApi(...).list_vms
+    offset: int
+        Index of the first item, must be a multiple of `limit` to map onto
+        the pages of Nutanix.
+    limit: int
+        Page size, at most 100.
+    kwargs:
+        Any other kwargs to pass to the call, ie '_filter'.
+
+    Returns
+    -------
+    ListPage[T]
+        Where T is the response.data item type, with the total if reported.
+    """
+    if offset % limit:
+        raise ValueError(f"Offset {offset} is not a multiple of the limit {limit}")
+    resp = op(**kwargs, _page=offset // limit, _limit=limit)
+    metadata: None | ApiResponseMetadata = resp.metadata  # type: ignore
+    return ListPage(
+        items=resp.data or [],  # type: ignore
+        offset=offset,
+        limit=limit,
+        total=metadata.total_available_results if metadata else None,
+    )
+
+
+def _iter_pages_concurrently(
+    fetch: Callable[[int], ResponseType], n_pages: int, concurrency: int
+) -> Iterator[list[object]]:
+    """Fetch pages 1..n_pages on a sliding window of futures, yielding in order"""
+    pages = iter(range(1, n_pages))
+    workers = min(concurrency, n_pages - 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque(
+            pool.submit(tracing.propagate(fetch), page)
+            for page in islice(pages, workers)
+        )
+        try:
+            while pending:
+                resp = pending.popleft().result()
+                if (page := next(pages, None)) is not None:
+                    pending.append(pool.submit(tracing.propagate(fetch), page))
+                yield resp.data or []  # type: ignore
+        finally:
+            # Consumer stopped early (or a page failed), don't fetch the rest
+            for future in pending:
+                future.cancel()
+
+
+def _is_last_page(resp) -> bool:
+    """Check the response links to see if this is the final page"""
+    metadata: None | ApiResponseMetadata = resp.metadata
+    if metadata:
+        links = {link.rel: link.href for link in metadata.links or []}
+        return not links or links.get("self") == links.get("last")
+    return True
+
+
+def _n_pages(resp, limit: int) -> None | int:
+    """Number of pages implied by `total_available_results`, if reported"""
+    metadata: None | ApiResponseMetadata = resp.metadata
+    total = metadata.total_available_results if metadata else None
+    if total is None:
+        return None
+    return math.ceil(total / limit)
+
+
+def odata_filter(*clauses: None | str) -> None | str:
+    """Join OData `$filter` clauses with 'and', skipping empty ones"""
+    clauses = tuple(clause for clause in clauses if clause)
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return " and ".join(f"({clause})" for clause in clauses)
+
+
+def odata_str(value: str) -> str:
+    """Quote a string literal for use in an OData expression"""
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
+
+
+def odata_datetime(value: datetime.datetime) -> str:
+    """Format a timezone aware datetime as an OData literal, in UTC"""
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def odata_select(model: type, **paths: None | str | tuple[str, ...]) -> str:
+    """
+    Build an OData `$select` projection from the fields of a dataclass.
+
+    Each field maps to the API property of the same name in camelCase. `paths`
+    overrides that for fields derived from other properties, ie
+    `mac_address="nics"` or a tuple of several, or drops a field which can't
+    be selected with `None`.
+    """
+    properties: dict[str, None] = {}
+    for field in dataclasses.fields(model):
+        path = paths[field.name] if field.name in paths else camel(field.name)
+        for prop in (path,) if isinstance(path, str) else path or ():
+            properties[prop] = None
+    return ",".join(properties)
+
+
+def camel(name: str) -> str:
+    head, *tail = name.split("_")
+    return head + "".join(part.title() for part in tail)
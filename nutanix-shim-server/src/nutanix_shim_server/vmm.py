@@ -4,8 +4,9 @@ import dataclasses
 import datetime
 import enum
 import logging
-import time
-from typing import Literal, Self, cast
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, Literal, Self, TypeVar, cast
 
 import ntnx_prism_py_client as prism
 import ntnx_vmm_py_client as vmm
@@ -24,58 +25,73 @@ from ntnx_vmm_py_client.models.vmm.v4.ahv.config.VmDisk import (
     VmDisk,
     VmDiskContainerReference,
 )
-
-from nutanix_shim_server import server
-from nutanix_shim_server.utils import paginate
+from ntnx_vmm_py_client.rest import ApiException
+
+from nutanix_shim_server import raw, server, tracing
+from nutanix_shim_server.cache import EtagCache
+from nutanix_shim_server.clients import NutanixClients
+from nutanix_shim_server.polling import Deadline, poll_until
+from nutanix_shim_server.raw import parse_datetime
+from nutanix_shim_server.singleflight import single_flight
+from nutanix_shim_server.tasks import TaskWatcher
+from nutanix_shim_server.utils import (
+    ListPage,
+    camel,
+    fetch_page,
+    iter_pages,
+    odata_datetime,
+    odata_filter,
+    odata_select,
+    odata_str,
+    paginate,
+)
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# How long to wait for a batch of power actions to be done
+BATCH_TIMEOUT_SECONDS = 300
+
+# Most ext_ids combined into one `$filter`, to keep the request URL short
+EXT_ID_FILTER_BATCH_SIZE = 50
+
+VM_ACTIONS_URI = "/api/vmm/v4.0/ahv/config/vms/{extId}/$actions"
+
+# `$objectType` of a disk backed by a VM disk, rather than ie a volume group
+VM_DISK_OBJECT_TYPE = "vmm.v4.ahv.config.VmDisk"
+
+# `rel` of the VMs in the entities affected by a Prism task
+VM_ENTITY_RELS = frozenset({"vmm:ahv:vm", "vmm:ahv:config:vm"})
+
 
 class VirtualMachineMgmt:
-    config: vmm.Configuration
-
-    def __init__(self, ctx: server.Context):
-        self.config = vmm.Configuration()
-        self.config.host = ctx.nutanix_host
-        self.config.scheme = ctx.nutanix_host_scheme
-        self.config.set_api_key(ctx.nutanix_api_key)
-        self.config.max_retry_attempts = 3
-        self.config.backoff_factor = 3
-        self.config.verify_ssl = ctx.nutanix_host_verify_ssl
-        self.config.port = ctx.nutanix_host_port
-        self.config.client_certificate_file = ctx.nutanix_client_certificate_file
-        self.config.root_ca_certificate_file = ctx.nutanix_root_ca_certificate_file
-
-        # Prism config for task polling
-        self.prism_config = prism.Configuration()
-        self.prism_config.host = ctx.nutanix_host
-        self.prism_config.scheme = ctx.nutanix_host_scheme
-        self.prism_config.set_api_key(ctx.nutanix_api_key)
-        self.prism_config.max_retry_attempts = 3
-        self.prism_config.backoff_factor = 3
-        self.prism_config.verify_ssl = ctx.nutanix_host_verify_ssl
-        self.prism_config.port = ctx.nutanix_host_port
-        self.prism_config.client_certificate_file = ctx.nutanix_client_certificate_file
-        self.prism_config.root_ca_certificate_file = (
-            ctx.nutanix_root_ca_certificate_file
-        )
+    def __init__(self, ctx: server.Context, clients: None | NutanixClients = None):
+        self.clients = clients or NutanixClients(ctx)
+        self.pagination_concurrency = ctx.nutanix_pagination_concurrency
+        self.raw_json = ctx.nutanix_raw_json
+
+        # Provisioning slots per cluster, shared by single and bulk provisioning
+        self.provision_cluster_concurrency = ctx.nutanix_provision_cluster_concurrency
+        self._cluster_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._cluster_slots_lock = threading.Lock()
+
+        self.power_action_concurrency = ctx.nutanix_power_action_concurrency
+
+        # ETags of fetched VMs, to mutate them without fetching them again
+        self.etags = EtagCache()
 
     @property
     def client(self) -> vmm.ApiClient:
         if not hasattr(self, "_client"):
-            self._client = vmm.ApiClient(self.config)
-            self._client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+            self._client = self.clients.vmm_client()
         return self._client
 
     @property
     def prism_client(self) -> prism.ApiClient:
         if not hasattr(self, "_prism_client"):
-            self._prism_client = prism.ApiClient(self.prism_config)
-            self._prism_client.add_default_header(
-                header_name="Accept-Encoding", header_value="gzip, deflate, br"
-            )
+            # Prism client for task polling
+            self._prism_client = self.clients.prism_client()
         return self._prism_client
 
     @property
@@ -84,6 +100,18 @@ class VirtualMachineMgmt:
             self._tasks_api = prism.TasksApi(self.prism_client)
         return self._tasks_api
 
+    @property
+    def batches_api(self) -> prism.BatchesApi:
+        if not hasattr(self, "_batches_api"):
+            self._batches_api = prism.BatchesApi(self.prism_client)
+        return self._batches_api
+
+    @property
+    def task_watcher(self) -> TaskWatcher:
+        if not hasattr(self, "_task_watcher"):
+            self._task_watcher = TaskWatcher(self.tasks_api.list_tasks)
+        return self._task_watcher
+
     @property
     def images_api(self) -> vmm.ImagesApi:
         if not hasattr(self, "_images_api"):
@@ -96,16 +124,134 @@ class VirtualMachineMgmt:
             self._vms_api = vmm.VmApi(self.client)
         return self._vms_api
 
-    def list_images(self) -> list[ImageMetadata]:
-        images: list[vmm.Image] = paginate(self.images_api.list_images)
-        return [ImageMetadata.from_nutanix_image(img) for img in images]
+    def _image_lister(
+        self,
+    ) -> tuple[Callable[..., object], Callable[[Any], "ImageMetadata"]]:
+        """List method and converter for images, on the raw JSON path if enabled"""
+        if self.raw_json:
+            return raw.list_op(self.client, raw.IMAGES_PATH), ImageMetadata.from_json
+        return self.images_api.list_images, ImageMetadata.from_nutanix_image
+
+    def _vm_lister(
+        self,
+    ) -> tuple[Callable[..., object], Callable[[Any], "VmListMetadata"]]:
+        """List method and converter for VMs, on the raw JSON path if enabled"""
+        if self.raw_json:
+            return raw.list_op(self.client, raw.VMS_PATH), VmListMetadata.from_json
+        return self.vms_api.list_vms, VmListMetadata.from_nutanix_vm
+
+    @single_flight
+    def list_images(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> list[ImageMetadata]:
+        """List images, optionally only those placed on a cluster or matching a name prefix"""
+        return [
+            img
+            for page in self.iter_images(cluster_ext_id, name_prefix)
+            for img in page
+        ]
+
+    def iter_images(
+        self, cluster_ext_id: None | str = None, name_prefix: None | str = None
+    ) -> Iterator[list[ImageMetadata]]:
+        """
+        Yield images one converted page at a time
 
-    def list_vms(self) -> list["VmListMetadata"]:
-        """List all VMs in the Nutanix environment"""
-        data: list[vmm.AhvConfigVm] = paginate(self.vms_api.list_vms)
-        vms = [VmListMetadata.from_nutanix_vm(vm) for vm in data]
-        return vms
+        The name prefix is filtered by Nutanix, the v4 images API can't filter
+        on cluster placement so that is done here. Only the properties used by
+        `ImageMetadata` are requested.
+        """
+        list_images, convert = self._image_lister()
+        for page in iter_pages(  # type: ignore
+            list_images,
+            concurrency=self.pagination_concurrency,
+            _select=ImageMetadata.select(),
+            _filter=odata_filter(
+                name_prefix and f"startswith(name, {odata_str(name_prefix)})"
+            ),
+        ):
+            with tracing.span("convert", "ImageMetadata"):
+                images = [convert(img) for img in page]
+            if cluster_ext_id:
+                images = [
+                    img
+                    for img in images
+                    if cluster_ext_id in (img.cluster_location_ext_ids or [])
+                ]
+            yield images
+
+    @single_flight
+    def list_vms(
+        self,
+        cluster_ext_id: None | str = None,
+        power_state: None | str = None,
+        name_prefix: None | str = None,
+    ) -> list["VmListMetadata"]:
+        """List all VMs in the Nutanix environment, optionally filtered"""
+        return [
+            vm
+            for page in self.iter_vms(cluster_ext_id, power_state, name_prefix)
+            for vm in page
+        ]
+
+    def iter_vms(
+        self,
+        cluster_ext_id: None | str = None,
+        power_state: None | str = None,
+        name_prefix: None | str = None,
+    ) -> Iterator[list["VmListMetadata"]]:
+        """
+        Yield VMs in the Nutanix environment one converted page at a time
+
+        All filters are passed on to Nutanix as `$filter`, so only matching
+        VMs are fetched, and only with the properties used by `VmListMetadata`.
+        """
+        list_vms, convert = self._vm_lister()
+        for page in iter_pages(  # type: ignore
+            list_vms,
+            concurrency=self.pagination_concurrency,
+            _select=VmListMetadata.select(),
+            _filter=_vm_filter(cluster_ext_id, power_state, name_prefix),
+        ):
+            with tracing.span("convert", "VmListMetadata"):
+                vms = [convert(vm) for vm in page]
+            yield vms
+
+    @single_flight
+    def list_vms_page(
+        self,
+        offset: int,
+        limit: int,
+        cluster_ext_id: None | str = None,
+        power_state: None | str = None,
+        name_prefix: None | str = None,
+    ) -> ListPage["VmListMetadata"]:
+        """
+        Get one page of VMs, optionally filtered, with a single Nutanix call.
+
+        Parameters
+        ----------
+            offset: Index of the first VM, a multiple of `limit`
+            limit: Number of VMs, at most 100
+            cluster_ext_id, power_state, name_prefix: As for `list_vms`
 
+        Returns
+        -------
+        ListPage[VmListMetadata]
+            with the total number of matching VMs
+        """
+        list_vms, convert = self._vm_lister()
+        page = fetch_page(
+            list_vms,
+            offset,
+            limit,
+            _select=VmListMetadata.select(),
+            _filter=_vm_filter(cluster_ext_id, power_state, name_prefix),
+        )
+        with tracing.span("convert", "VmListMetadata"):
+            return dataclasses.replace(page, items=[convert(vm) for vm in page.items])
+
+    @single_flight
     def get_vm_details(self, vm_ext_id: str) -> "VmDetailsMetadata":
         """
         Get detailed information about a VM including MAC address and IP addresses.
@@ -118,10 +264,11 @@ class VirtualMachineMgmt:
         -------
             VmDetailsMetadata with full VM details
         """
-        resp: vmm.AhvConfigGetVmApiResponse = self.vms_api.get_vm_by_id(extId=vm_ext_id)  # type: ignore
-        vm: vmm.AhvConfigVm = resp.data  # type: ignore
-        return VmDetailsMetadata.from_nutanix_vm(vm)
+        vm = self._get_vm(vm_ext_id)
+        with tracing.span("convert", "VmDetailsMetadata"):
+            return VmDetailsMetadata.from_nutanix_vm(vm)
 
+    @single_flight
     def get_vm_power_state(self, vm_ext_id: str) -> "VmPowerStateResponse":
         """
         Get the current power state of a VM.
@@ -134,15 +281,55 @@ class VirtualMachineMgmt:
         -------
             VmPowerStateResponse with the current power state
         """
-        resp: vmm.AhvConfigGetVmApiResponse = self.vms_api.get_vm_by_id(extId=vm_ext_id)  # type: ignore
-        vm: vmm.AhvConfigVm = resp.data  # type: ignore
-        power_state = str(vm.power_state) if vm.power_state else "UNDETERMINED"
-        return VmPowerStateResponse(
-            ext_id=vm_ext_id,
-            name=cast(str, vm.name),
-            power_state=power_state,
+        return self._get_vm_power_state(vm_ext_id)
+
+    def _get_vm_power_state(self, vm_ext_id: str) -> "VmPowerStateResponse":
+        vm = self._get_vm(vm_ext_id)
+        return dataclasses.replace(
+            VmPowerStateResponse.from_nutanix_vm(vm), ext_id=vm_ext_id
         )
 
+    def _get_vm(self, vm_ext_id: str) -> vmm.AhvConfigVm:
+        """Fetch a VM, remembering its ETag for later mutations"""
+        return self._get_vm_and_etag(vm_ext_id)[0]
+
+    def _get_vm_and_etag(self, vm_ext_id: str) -> tuple[vmm.AhvConfigVm, None | str]:
+        """
+        Fetch a VM and its current ETag, also remembering the ETag.
+
+        Mutations use the returned ETag rather than reading it back from the
+        shared cache, where a concurrent mutation of the VM may drop it.
+        """
+        resp: vmm.AhvConfigGetVmApiResponse = self.vms_api.get_vm_by_id(extId=vm_ext_id)  # type: ignore
+        etag = self.client.get_etag(resp)
+        self.etags.put(vm_ext_id, etag)
+        return resp.data, etag  # type: ignore
+
+    def _mutate_vm(self, vm_ext_id: str, mutate: Callable[[str], T]) -> T:
+        """
+        Call `mutate` with the VM's ETag, returning its result.
+
+        A cached ETag is used when there is one, the VM is only fetched for
+        its ETag when there isn't or when Nutanix rejects the cached one as
+        stale (412 Precondition Failed). The ETag is dropped afterwards, as
+        the mutation changes it.
+        """
+        try:
+            if (etag := self.etags.get(vm_ext_id)) is not None:
+                try:
+                    return mutate(etag)
+                except ApiException as e:
+                    if e.status != 412:
+                        raise
+                    logger.info(f"Cached ETag of VM {vm_ext_id} is stale, refetching")
+
+            _, etag = self._get_vm_and_etag(vm_ext_id)
+            if etag is None:
+                raise ValueError(f"Nutanix returned no ETag for VM {vm_ext_id}")
+            return mutate(etag)
+        finally:
+            self.etags.discard(vm_ext_id)
+
     def set_vm_power_state(
         self, vm_ext_id: str, action: "PowerAction"
     ) -> "VmPowerStateResponse":
@@ -159,11 +346,61 @@ class VirtualMachineMgmt:
         VmPowerStateResponse
             with the new power state
         """
-        # Fetch VM to get ETag (required for all power state operations)
-        get_resp = self.vms_api.get_vm_by_id(extId=vm_ext_id)
-        etag = self.client.get_etag(get_resp)
+        # Perform the requested power action with the VM's ETag
+        self._mutate_vm(
+            vm_ext_id, lambda etag: self._power_action(vm_ext_id, action, etag)
+        )
+
+        # Not coalesced with reads which started before the action
+        return self._get_vm_power_state(vm_ext_id)
+
+    def set_vm_power_states(
+        self,
+        vm_ext_ids: list[str],
+        action: "PowerAction",
+        use_batch_api: bool = False,
+    ) -> list["VmPowerActionResult"]:
+        """
+        Change the power state of several VMs.
+
+        The actions run concurrently, at most `power_action_concurrency` at a
+        time, or are submitted to Nutanix as a single Prism batch. Either way
+        the resulting power states are then read with a single VM listing.
+
+        Parameters
+        ----------
+            vm_ext_ids: The external IDs of the VMs
+            action: The power action to perform on all of them
+            use_batch_api: Submit the actions as one Prism batch
+
+        Returns
+        -------
+        list[VmPowerActionResult]
+            with the outcome for each VM, in the order of `vm_ext_ids`
+        """
+        vm_ext_ids = list(dict.fromkeys(vm_ext_ids))
+        if not vm_ext_ids:
+            return []
 
-        # Perform the requested power action with ETag
+        if use_batch_api:
+            errors = self._power_action_batch(vm_ext_ids, action)
+        else:
+            errors = self._power_action_concurrently(vm_ext_ids, action)
+
+        power_states = {
+            vm.ext_id: vm.power_state
+            for vm in self._get_vm_power_states(vm_ext_ids, None)
+        }
+        return [
+            VmPowerActionResult(
+                ext_id=vm_ext_id,
+                power_state=power_states.get(vm_ext_id),
+                error=errors.get(vm_ext_id),
+            )
+            for vm_ext_id in vm_ext_ids
+        ]
+
+    def _power_action(self, vm_ext_id: str, action: "PowerAction", etag) -> None:
         if action == PowerAction.POWER_ON:
             self.vms_api.power_on_vm(extId=vm_ext_id, if_match=etag)
         elif action == PowerAction.POWER_OFF:
@@ -177,7 +414,224 @@ class VirtualMachineMgmt:
         else:
             raise ValueError(f"Unknown power action: {action}")
 
-        return self.get_vm_power_state(vm_ext_id)
+    def _power_action_concurrently(
+        self, vm_ext_ids: list[str], action: "PowerAction"
+    ) -> dict[str, str]:
+        """Perform `action` on each VM, returning the errors by VM ext_id"""
+
+        def perform(vm_ext_id: str) -> None:
+            self._mutate_vm(
+                vm_ext_id, lambda etag: self._power_action(vm_ext_id, action, etag)
+            )
+
+        errors = {}
+        with ThreadPoolExecutor(
+            max_workers=min(len(vm_ext_ids), self.power_action_concurrency),
+            thread_name_prefix="power-action",
+        ) as executor:
+            futures = {
+                executor.submit(tracing.propagate(perform), i): i for i in vm_ext_ids
+            }
+            for future in as_completed(futures):
+                if error := future.exception():
+                    logger.error(
+                        f"{action.value} of VM {futures[future]} failed: {error}"
+                    )
+                    errors[futures[future]] = str(error)
+        return errors
+
+    def _power_action_batch(
+        self, vm_ext_ids: list[str], action: "PowerAction"
+    ) -> dict[str, str]:
+        """
+        Perform `action` on each VM in a single Prism batch, returning the
+        errors by VM ext_id.
+
+        The ETags required by the actions are fetched per VM, never taken from
+        the ETag cache: Prism only reports how many operations of a batch
+        failed, not which ones, so a single stale ETag would have the batch
+        error reported for every VM in it, with no way to retry just that VM.
+        """
+        errors = {}
+        etags = {}
+        with ThreadPoolExecutor(
+            max_workers=min(len(vm_ext_ids), self.power_action_concurrency),
+            thread_name_prefix="power-action",
+        ) as executor:
+            futures = {
+                executor.submit(tracing.propagate(self._get_vm_and_etag), i): i
+                for i in vm_ext_ids
+            }
+            for future in as_completed(futures):
+                if error := future.exception():
+                    errors[futures[future]] = str(error)
+                elif etag := future.result()[1]:
+                    etags[futures[future]] = etag
+                else:
+                    errors[futures[future]] = "Nutanix returned no ETag for the VM"
+        if not etags:
+            return errors
+        for vm_ext_id in etags:
+            self.etags.discard(vm_ext_id)
+
+        batch = prism.BatchSpec(
+            metadata=prism.BatchSpecMetadata(
+                action=prism.ActionType.ACTION,
+                name=f"{action.value} of {len(etags)} VMs",
+                uri=f"{VM_ACTIONS_URI}/{POWER_ACTION_PATHS[action]}",
+                should_stop_on_error=False,
+                chunk_size=self.power_action_concurrency,
+            ),
+            payload=[
+                prism.BatchSpecPayload(
+                    metadata=prism.BatchSpecPayloadMetadata(
+                        headers=[
+                            prism.BatchSpecPayloadMetadataHeader(
+                                name="If-Match", value=etag
+                            )
+                        ],
+                        path=[
+                            prism.BatchSpecPayloadMetadataPath(
+                                name="extId", value=vm_ext_id
+                            )
+                        ],
+                    )
+                )
+                for vm_ext_id, etag in etags.items()
+            ],
+        )
+        resp: prism.SubmitBatchApiResponse = self.batches_api.submit_batch(body=batch)  # type: ignore
+        task_ext_id = cast(str, resp.data.ext_id)  # type: ignore
+        logger.info(f"Submitted {batch.metadata.name} as task {task_ext_id}")
+
+        future = self.task_watcher.watch(task_ext_id)
+        try:
+            task: prism.Task = future.result(timeout=BATCH_TIMEOUT_SECONDS).value
+        except TimeoutError:
+            future.cancel()
+            error = f"Batch did not complete within {BATCH_TIMEOUT_SECONDS} seconds"
+        else:
+            if str(task.status) == "SUCCEEDED":
+                return errors
+            error = f"Batch failed: {task.error_messages or 'Unknown error'}"
+
+        logger.error(f"{batch.metadata.name}: {error}")
+        return errors | {vm_ext_id: error for vm_ext_id in etags}
+
+    @single_flight
+    def get_vm_power_states(
+        self,
+        vm_ext_ids: None | list[str] = None,
+        cluster_ext_id: None | str = None,
+    ) -> list["VmPowerStateResponse"]:
+        """
+        Get the current power state of many VMs at once.
+
+        Rather than fetching each VM, VMs are listed with only the properties
+        needed, filtered on their ext_ids (up to `EXT_ID_FILTER_BATCH_SIZE`
+        per request) and/or cluster.
+
+        Parameters
+        ----------
+            vm_ext_ids: Only these VMs, unknown ones are left out of the result
+            cluster_ext_id: Only VMs on this cluster
+
+        Returns
+        -------
+        list[VmPowerStateResponse]
+            for the matching VMs
+        """
+        return self._get_vm_power_states(vm_ext_ids, cluster_ext_id)
+
+    def _get_vm_power_states(
+        self, vm_ext_ids: None | list[str], cluster_ext_id: None | str
+    ) -> list["VmPowerStateResponse"]:
+        cluster_filter = cluster_ext_id and (
+            f"cluster/extId eq {odata_str(cluster_ext_id)}"
+        )
+        if vm_ext_ids is None:
+            filters = [odata_filter(cluster_filter)]
+        else:
+            filters = _ext_id_filters(vm_ext_ids, cluster_filter)
+
+        power_states = []
+        for vm_filter in filters:
+            page: list[vmm.AhvConfigVm]
+            for page in iter_pages(  # type: ignore
+                self.vms_api.list_vms,
+                concurrency=self.pagination_concurrency,
+                _select="extId,name,powerState",
+                _filter=vm_filter,
+            ):
+                power_states.extend(
+                    VmPowerStateResponse.from_nutanix_vm(vm) for vm in page
+                )
+        return power_states
+
+    def get_vms(self, vm_ext_ids: list[str]) -> list["VmListMetadata"]:
+        """
+        Get the listing metadata of specific VMs.
+
+        VMs are listed filtered on their ext_ids, up to
+        `EXT_ID_FILTER_BATCH_SIZE` per request. Unknown (ie deleted) VMs are
+        left out of the result.
+        """
+        vms = []
+        list_vms, convert = self._vm_lister()
+        for vm_filter in _ext_id_filters(vm_ext_ids):
+            for page in iter_pages(  # type: ignore
+                list_vms,
+                concurrency=self.pagination_concurrency,
+                _select=VmListMetadata.select(),
+                _filter=vm_filter,
+            ):
+                vms.extend(convert(vm) for vm in page)
+        return vms
+
+    def changed_vm_ext_ids(self, since: datetime.datetime) -> set[str]:
+        """
+        Ext_ids of VMs affected by a Prism task updated after `since`.
+
+        The v4 VMM API can't filter VMs on their modification time, but every
+        change made through Nutanix (create, update, power action, delete)
+        runs as a task listing the VMs it affects.
+        """
+        tasks: list[prism.Task] = paginate(  # type: ignore
+            self.tasks_api.list_tasks,
+            _select="entitiesAffected",
+            _filter=f"lastUpdatedTime gt {odata_datetime(since)}",
+        )
+        return {
+            entity.ext_id
+            for task in tasks
+            for entity in task.entities_affected or []
+            if entity.rel in VM_ENTITY_RELS and entity.ext_id
+        }
+
+    def images_changed_since(self, since: datetime.datetime) -> list["ImageMetadata"]:
+        """
+        Images created or updated after `since`.
+
+        Images are listed most recently updated first, page by page, until a
+        page reaches back to `since`.
+        """
+        changed = []
+        list_images, convert = self._image_lister()
+        for page in iter_pages(  # type: ignore
+            list_images,
+            _select=ImageMetadata.select(),
+            _orderby="lastUpdateTime desc",
+        ):
+            images = [convert(img) for img in page]
+            changed.extend(
+                img
+                for img in images
+                if img.last_update_time is None or img.last_update_time > since
+            )
+            oldest = images[-1].last_update_time
+            if oldest is not None and oldest <= since:
+                break
+        return changed
 
     def delete_vm(self, vm_ext_id: str) -> None:
         """
@@ -191,28 +645,137 @@ class VirtualMachineMgmt:
         ------
             ApiException: If the VM cannot be deleted
         """
-        # First fetch the VM to get its ETag (required for deletion)
-        get_resp = self.vms_api.get_vm_by_id(extId=vm_ext_id)
-        etag = self.client.get_etag(get_resp)
-
-        # Delete with the ETag header
-        self.vms_api.delete_vm_by_id(extId=vm_ext_id, if_match=etag)
+        # Delete with the ETag header (required for deletion)
+        self._mutate_vm(
+            vm_ext_id,
+            lambda etag: self.vms_api.delete_vm_by_id(extId=vm_ext_id, if_match=etag),
+        )
 
-    def provision_vm(self, request: "VmProvisionRequest") -> "VmMetadata":
+    def provision_vm(
+        self,
+        request: "VmProvisionRequest",
+        progress: None | Callable[[str], None] = None,
+    ) -> "VmMetadata":
         """
         Provision a new VM with network (not image-based), CPU, memory, and disk configuration.
 
         Parameters
         ----------
             request: VM provisioning request with all required specifications
+            progress: Optional callback receiving a message as each step starts
 
         Returns
         -------
         VmMetadata
             with information about the created VM
         """
-        # TODO: This method is wildly too large
+        report = progress or (lambda message: None)
+
+        slots = self._provision_slots(request.cluster_ext_id)
+        if not slots.acquire(blocking=False):
+            report(f"Waiting for a free provisioning slot on {request.cluster_ext_id}")
+            slots.acquire()
+        try:
+            return self._provision_vm(request, report)
+        finally:
+            slots.release()
+
+    def provision_vms(
+        self,
+        requests: list["VmProvisionRequest"],
+        progress: None | Callable[[str], None] = None,
+    ) -> list["VmProvisionResult"]:
+        """
+        Provision several VMs concurrently.
 
+        Each VM is provisioned as by `provision_vm`, at most
+        `provision_cluster_concurrency` at a time per cluster, while their
+        creation tasks are all tracked by the shared task watcher. A failing
+        VM doesn't affect the others.
+
+        Parameters
+        ----------
+            requests: VM provisioning requests
+            progress: Optional callback receiving a message as each VM is done
+
+        Returns
+        -------
+        list[VmProvisionResult]
+            with the outcome of each request, in the order of `requests`
+        """
+        report = progress or (lambda message: None)
+        results: list[None | VmProvisionResult] = [None] * len(requests)
+        if not requests:
+            return []
+
+        n_clusters = len({request.cluster_ext_id for request in requests})
+        max_workers = min(
+            len(requests), n_clusters * self.provision_cluster_concurrency
+        )
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="provision"
+        ) as executor:
+            futures = {
+                executor.submit(tracing.propagate(self.provision_vm), request): i
+                for i, request in enumerate(requests)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                try:
+                    results[i] = VmProvisionResult(
+                        name=requests[i].name, vm=future.result()
+                    )
+                except Exception as e:
+                    logger.error(f"Provisioning VM {requests[i].name} failed: {e}")
+                    results[i] = VmProvisionResult(name=requests[i].name, error=str(e))
+                report(f"{done} of {len(requests)} VMs done")
+
+        return cast(list[VmProvisionResult], results)
+
+    def _provision_slots(self, cluster_ext_id: str) -> threading.BoundedSemaphore:
+        with self._cluster_slots_lock:
+            if cluster_ext_id not in self._cluster_slots:
+                self._cluster_slots[cluster_ext_id] = threading.BoundedSemaphore(
+                    self.provision_cluster_concurrency
+                )
+            return self._cluster_slots[cluster_ext_id]
+
+    def _provision_vm(
+        self, request: "VmProvisionRequest", report: Callable[[str], None]
+    ) -> "VmMetadata":
+        deadline = Deadline(request.timeout_seconds)
+
+        vm_spec = self._build_vm_spec(request)
+
+        # Create the VM - this returns a task reference, not the VM directly
+        report("Submitting VM creation")
+        resp: vmm.CreateVmApiResponse = self.vms_api.create_vm(body=vm_spec)  # type: ignore
+
+        # Get task ID - keep the full format including prefix for the tasks API
+        task_ext_id = cast(str, resp.data.ext_id)  # type: ignore
+
+        report(f"Waiting for VM creation task {task_ext_id}")
+        vm_ext_id = self._wait_for_created_vm(task_ext_id, deadline)
+
+        # Handle power-on if requested
+        if request.power_on:
+            report(f"Powering on VM {vm_ext_id}")
+            self._power_on_and_verify(vm_ext_id, deadline)
+        else:
+            logger.info("Power-on not requested, VM will remain off")
+
+        return VmMetadata(
+            ext_id=vm_ext_id,
+            name=request.name,
+            description=request.description,
+            num_sockets=request.num_sockets,
+            num_cores_per_socket=request.num_cores_per_socket,
+            memory_size_bytes=request.memory_size_bytes,
+            disk_size_bytes=request.disk_size_bytes,
+        )
+
+    def _build_vm_spec(self, request: "VmProvisionRequest") -> vmm.AhvConfigVm:
+        """Build the SDK VM specification for a provisioning request"""
         cluster_ref = vmm.AhvConfigClusterReference(ext_id=request.cluster_ext_id)
 
         # Create network configuration with subnet reference and DHCP
@@ -256,7 +819,7 @@ class VirtualMachineMgmt:
             boot_config = vmm.UefiBoot(is_secure_boot_enabled=request.secure_boot)
 
         # Create VM specification
-        vm_spec = vmm.AhvConfigVm(
+        return vmm.AhvConfigVm(
             name=request.name,
             description=request.description,
             cluster=cluster_ref,
@@ -268,169 +831,96 @@ class VirtualMachineMgmt:
             boot_config=boot_config,
         )
 
-        # Create the VM - this returns a task reference, not the VM directly
-        resp: vmm.CreateVmApiResponse = self.vms_api.create_vm(body=vm_spec)  # type: ignore
+    def _wait_for_created_vm(self, task_ext_id: str, deadline: Deadline) -> str:
+        """Wait for a VM creation task to succeed, returning the new VM's ext_id"""
+        logger.info(f"Waiting for VM creation task {task_ext_id} to complete...")
 
-        # Get task ID - keep the full format including prefix for the tasks API
-        task_ext_id = cast(str, resp.data.ext_id)  # type: ignore
+        future = self.task_watcher.watch(task_ext_id)
+        try:
+            result = future.result(timeout=deadline.remaining())
+        except TimeoutError:
+            future.cancel()
+            raise TimeoutError(
+                f"VM creation task did not complete within {deadline.seconds} seconds"
+            )
 
-        logger.info(f"Waiting for VM creation task {task_ext_id} to complete...")
+        task: prism.Task = result.value
+        status = str(task.status) if task.status else "UNKNOWN"
+        logger.info(f"Task status: {status} after {result.polls} polls")
 
-        # Poll for task completion
-        max_wait_seconds = 120
-        poll_interval = 2
-        elapsed = 0
-
-        while elapsed < max_wait_seconds:
-            task_resp = self.tasks_api.get_task_by_id(extId=task_ext_id)
-            task = task_resp.data  # type: ignore
-            status = str(task.status) if task.status else "UNKNOWN"
-
-            logger.info(f"Task status: {status}")
-
-            if status == "SUCCEEDED":
-                # Extract VM ext_id from entities_affected
-                if task.entities_affected:
-                    for entity in task.entities_affected:
-                        # The VM entity will have the ext_id we need
-                        vm_ext_id = entity.ext_id
-                        logger.info(f"VM created successfully with ext_id: {vm_ext_id}")
-
-                        # Handle power-on if requested
-                        if request.power_on:
-                            try:
-                                logger.info(
-                                    f"Power-on requested, powering on VM {vm_ext_id}..."
-                                )
-                                # Fetch VM to get ETag (required for power-on operation)
-                                get_resp = self.vms_api.get_vm_by_id(extId=vm_ext_id)
-                                etag = self.client.get_etag(get_resp)
-                                self.vms_api.power_on_vm(extId=vm_ext_id, if_match=etag)
-
-                                # Verify VM actually powered on
-                                logger.info(f"Verifying VM power state...")
-                                power_on_verified = False
-                                power_check_timeout = 60  # 60 seconds to power on
-                                power_check_interval = 3
-                                power_elapsed = 0
-
-                                while power_elapsed < power_check_timeout:
-                                    try:
-                                        power_resp = self.vms_api.get_vm_by_id(
-                                            extId=vm_ext_id
-                                        )
-                                        vm_data = power_resp.data  # type: ignore
-                                        current_power_state = (
-                                            str(vm_data.power_state)
-                                            if vm_data.power_state
-                                            else "UNKNOWN"
-                                        )
-                                        logger.info(
-                                            f"Current power state: {current_power_state}"
-                                        )
-
-                                        if current_power_state == "ON":
-                                            logger.info(
-                                                f"VM {vm_ext_id} successfully powered on"
-                                            )
-                                            power_on_verified = True
-                                            break
-
-                                        time.sleep(power_check_interval)
-                                        power_elapsed += power_check_interval
-                                    except Exception as check_error:
-                                        logger.warning(
-                                            f"Error checking power state: {check_error}"
-                                        )
-                                        time.sleep(power_check_interval)
-                                        power_elapsed += power_check_interval
-
-                                if not power_on_verified:
-                                    # Power-on failed, rollback by deleting the VM
-                                    error_msg = f"VM created but failed to power on within {power_check_timeout} seconds"
-                                    logger.error(
-                                        f"{error_msg}, rolling back by deleting VM {vm_ext_id}"
-                                    )
-
-                                    try:
-                                        # Delete the VM
-                                        get_resp = self.vms_api.get_vm_by_id(
-                                            extId=vm_ext_id
-                                        )
-                                        etag = self.client.get_etag(get_resp)
-                                        self.vms_api.delete_vm_by_id(
-                                            extId=vm_ext_id, if_match=etag
-                                        )
-                                        logger.info(
-                                            f"VM {vm_ext_id} deleted successfully during rollback"
-                                        )
-                                    except Exception as delete_error:
-                                        logger.error(
-                                            f"Failed to delete VM during rollback: {delete_error}"
-                                        )
-                                        error_msg += f". Additionally, failed to delete VM: {delete_error}"
-
-                                    raise RuntimeError(error_msg)
-
-                            except RuntimeError:
-                                # Re-raise RuntimeError from power-on verification failure
-                                raise
-                            except Exception as power_error:
-                                # Power-on command itself failed, rollback
-                                error_msg = f"Failed to power on VM: {power_error}"
-                                logger.error(
-                                    f"{error_msg}, rolling back by deleting VM {vm_ext_id}"
-                                )
-
-                                try:
-                                    # Delete the VM
-                                    get_resp = self.vms_api.get_vm_by_id(
-                                        extId=vm_ext_id
-                                    )
-                                    etag = self.client.get_etag(get_resp)
-                                    self.vms_api.delete_vm_by_id(
-                                        extId=vm_ext_id, if_match=etag
-                                    )
-                                    logger.info(
-                                        f"VM {vm_ext_id} deleted successfully during rollback"
-                                    )
-                                except Exception as delete_error:
-                                    logger.error(
-                                        f"Failed to delete VM during rollback: {delete_error}"
-                                    )
-                                    error_msg += f". Additionally, failed to delete VM: {delete_error}"
-
-                                raise RuntimeError(error_msg)
-                        else:
-                            logger.info("Power-on not requested, VM will remain off")
-
-                        return VmMetadata(
-                            ext_id=vm_ext_id,
-                            name=request.name,
-                            description=request.description,
-                            num_sockets=request.num_sockets,
-                            num_cores_per_socket=request.num_cores_per_socket,
-                            memory_size_bytes=request.memory_size_bytes,
-                            disk_size_bytes=request.disk_size_bytes,
-                        )
-
-                raise ValueError("Task succeeded but no VM entity found in response")
-
-            elif status == "FAILED":
-                error_msg = (
-                    task.error_messages
-                    if hasattr(task, "error_messages")
-                    else "Unknown error"
-                )
-                raise ValueError(f"VM creation task failed: {error_msg}")
+        if status == "SUCCEEDED":
+            # Extract VM ext_id from entities_affected
+            for entity in task.entities_affected or []:
+                # The VM entity will have the ext_id we need
+                vm_ext_id = cast(str, entity.ext_id)
+                logger.info(f"VM created successfully with ext_id: {vm_ext_id}")
+                return vm_ext_id
 
-            time.sleep(poll_interval)
-            elapsed += poll_interval
+            raise ValueError("Task succeeded but no VM entity found in response")
+
+        error_msg = task.error_messages or "Unknown error"
+        raise ValueError(f"VM creation task failed: {error_msg}")
+
+    def _power_on_and_verify(self, vm_ext_id: str, deadline: Deadline) -> None:
+        """
+        Power on a newly created VM and wait for it to report ON.
 
-        raise TimeoutError(
-            f"VM creation task did not complete within {max_wait_seconds} seconds"
+        If the VM can't be powered on before the deadline it is deleted again
+        and a RuntimeError raised.
+        """
+        try:
+            logger.info(f"Power-on requested, powering on VM {vm_ext_id}...")
+            # Power-on requires the VM's ETag
+            self._mutate_vm(
+                vm_ext_id,
+                lambda etag: self.vms_api.power_on_vm(extId=vm_ext_id, if_match=etag),
+            )
+        except Exception as power_error:
+            # Power-on command itself failed, rollback
+            error_msg = f"Failed to power on VM: {power_error}"
+            raise RuntimeError(self._rollback_vm(vm_ext_id, error_msg))
+
+        def is_powered_on() -> None | bool:
+            try:
+                vm_data = self._get_vm(vm_ext_id)
+                current_power_state = (
+                    str(vm_data.power_state) if vm_data.power_state else "UNKNOWN"
+                )
+                logger.info(f"Current power state: {current_power_state}")
+                return True if current_power_state == "ON" else None
+            except Exception as check_error:
+                logger.warning(f"Error checking power state: {check_error}")
+                return None
+
+        # Verify VM actually powered on
+        logger.info("Verifying VM power state...")
+        try:
+            result = poll_until(
+                is_powered_on, deadline, what=f"VM {vm_ext_id} power-on"
+            )
+        except TimeoutError as e:
+            # Power-on failed, rollback by deleting the VM
+            error_msg = f"VM created but failed to power on: {e}"
+            raise RuntimeError(self._rollback_vm(vm_ext_id, error_msg))
+
+        logger.info(
+            f"VM {vm_ext_id} successfully powered on after {result.polls} polls"
         )
 
+    def _rollback_vm(self, vm_ext_id: str, error_msg: str) -> str:
+        """Delete a VM which failed provisioning, returning the error message to raise"""
+        logger.error(f"{error_msg}, rolling back by deleting VM {vm_ext_id}")
+
+        try:
+            # Delete the VM, with the ETag from the last poll if there was one
+            self.delete_vm(vm_ext_id)
+            logger.info(f"VM {vm_ext_id} deleted successfully during rollback")
+        except Exception as delete_error:
+            logger.error(f"Failed to delete VM during rollback: {delete_error}")
+            error_msg += f". Additionally, failed to delete VM: {delete_error}"
+
+        return error_msg
+
 
 @dataclasses.dataclass(frozen=True)
 class ImageMetadata:
@@ -449,11 +939,25 @@ class ImageMetadata:
 
     keys = __annotations__
 
+    @classmethod
+    def select(cls) -> str:
+        """`$select` projection of the image properties this model needs"""
+        # Neither is selectable in the v4 list API, so they're left out of listings
+        return odata_select(cls, source=None, placement_policy_status=None)
+
     @classmethod
     def from_nutanix_image(cls, image: vmm.Image) -> Self:
         kwargs = {k: v for k, v in image.to_dict().items() if k in cls.keys}
         return cls(**kwargs)
 
+    @classmethod
+    def from_json(cls, image: dict[str, Any]) -> Self:
+        """Convert an image of a raw JSON response, like `from_nutanix_image`"""
+        kwargs = {k: image.get(camel(k)) for k in cls.keys}
+        kwargs["create_time"] = parse_datetime(kwargs["create_time"])
+        kwargs["last_update_time"] = parse_datetime(kwargs["last_update_time"])
+        return cls(**kwargs)
+
 
 @dataclasses.dataclass(frozen=True)
 class VmListMetadata:
@@ -476,6 +980,17 @@ class VmListMetadata:
     create_time: None | datetime.datetime
     disk_size_bytes: None | int
 
+    @classmethod
+    def select(cls) -> str:
+        """`$select` projection of the VM properties this model needs"""
+        return odata_select(
+            cls,
+            cluster_ext_id="cluster/extId",
+            mac_address="nics",
+            ip_addresses="nics",
+            disk_size_bytes="disks",
+        )
+
     @classmethod
     def from_nutanix_vm(cls, vm: vmm.AhvConfigVm) -> Self:
         """Convert Nutanix SDK VM to our response model"""
@@ -524,6 +1039,41 @@ class VmListMetadata:
             disk_size_bytes=disk_size_bytes,
         )
 
+    @classmethod
+    def from_json(cls, vm: dict[str, Any]) -> Self:
+        """Convert a VM of a raw JSON response, like `from_nutanix_vm`"""
+        mac_address = None
+        ip_addresses = []
+        if nics := vm.get("nics"):
+            first_nic = nics[0]
+            if backing_info := first_nic.get("backingInfo"):
+                mac_address = backing_info.get("macAddress")
+            if network_info := first_nic.get("networkInfo"):
+                ipv4_config = network_info.get("ipv4Config") or {}
+                if (ip_addr := ipv4_config.get("ipAddress")) is not None:
+                    ip_addresses.append(ip_addr.get("value"))
+
+        disk_size_bytes = None
+        if disks := vm.get("disks"):
+            backing_info = disks[0].get("backingInfo") or {}
+            if backing_info.get("$objectType") == VM_DISK_OBJECT_TYPE:
+                disk_size_bytes = backing_info.get("diskSizeBytes")
+
+        return cls(
+            ext_id=vm["extId"],
+            name=vm["name"],
+            description=vm.get("description"),
+            cluster_ext_id=(vm.get("cluster") or {}).get("extId"),
+            power_state=vm.get("powerState"),
+            num_sockets=vm.get("numSockets"),
+            num_cores_per_socket=vm.get("numCoresPerSocket"),
+            memory_size_bytes=vm.get("memorySizeBytes"),
+            mac_address=mac_address,
+            ip_addresses=ip_addresses,
+            create_time=parse_datetime(vm.get("createTime")),
+            disk_size_bytes=disk_size_bytes,
+        )
+
 
 @dataclasses.dataclass(frozen=True)
 class VmDetailsMetadata:
@@ -641,6 +1191,33 @@ class VmDetailsMetadata:
         )
 
 
+def _vm_filter(
+    cluster_ext_id: None | str, power_state: None | str, name_prefix: None | str
+) -> None | str:
+    """`$filter` of VMs on the filters of `list_vms`"""
+    return odata_filter(
+        cluster_ext_id and f"cluster/extId eq {odata_str(cluster_ext_id)}",
+        power_state
+        and f"powerState eq Vmm.Ahv.Config.PowerState{odata_str(power_state)}",
+        name_prefix and f"startswith(name, {odata_str(name_prefix)})",
+    )
+
+
+def _ext_id_filters(ext_ids: list[str], *clauses: None | str) -> list[None | str]:
+    """`$filter`s matching `ext_ids`, `EXT_ID_FILTER_BATCH_SIZE` per filter"""
+    ext_ids = list(dict.fromkeys(ext_ids))
+    return [
+        odata_filter(
+            *clauses,
+            " or ".join(f"extId eq {odata_str(i)}" for i in chunk),
+        )
+        for chunk in (
+            ext_ids[start : start + EXT_ID_FILTER_BATCH_SIZE]
+            for start in range(0, len(ext_ids), EXT_ID_FILTER_BATCH_SIZE)
+        )
+    ]
+
+
 def _disk_container_ref_from_disk(disk: Disk) -> VmDiskContainerReference | None:
     info: None | VmDisk | ADSFVolumeGroupReference = disk.backing_info
     if isinstance(info, VmDisk):
@@ -678,6 +1255,7 @@ class VmProvisionRequest:
             "power_on": true,                  # Auto power-on after creation
             "boot_method": "uefi",             # uefi | bios
             "secure_boot": true,               # secure boot conf - applicable only to UEFI
+            "timeout_seconds": 180,            # budget for creation and power-on
         }
     """
 
@@ -693,6 +1271,7 @@ class VmProvisionRequest:
     power_on: bool = True
     boot_method: Literal["bios", "uefi"] = "uefi"
     secure_boot: bool = False
+    timeout_seconds: int = 180
 
 
 @dataclasses.dataclass(frozen=True)
@@ -710,6 +1289,19 @@ class VmMetadata:
     disk_size_bytes: int
 
 
+@dataclasses.dataclass(frozen=True)
+class VmProvisionResult:
+    """
+    Response model for the outcome of one VM of a bulk provisioning request.
+
+    Exactly one of `vm` (on success) and `error` (on failure) is set.
+    """
+
+    name: str
+    vm: None | VmMetadata = None
+    error: None | str = None
+
+
 class PowerAction(str, enum.Enum):
     """
     Available power actions for VMs.
@@ -728,6 +1320,16 @@ class PowerAction(str, enum.Enum):
     RESET = "RESET"
 
 
+# Path of each power action below a VM's `$actions`, for Prism batches
+POWER_ACTION_PATHS = {
+    PowerAction.POWER_ON: "power-on",
+    PowerAction.POWER_OFF: "power-off",
+    PowerAction.SHUTDOWN: "shutdown",
+    PowerAction.REBOOT: "reboot",
+    PowerAction.RESET: "reset",
+}
+
+
 @dataclasses.dataclass
 class PowerStateChangeRequest:
     """
@@ -742,6 +1344,41 @@ class PowerStateChangeRequest:
     action: PowerAction
 
 
+@dataclasses.dataclass
+class BulkPowerStateChangeRequest:
+    """
+    Request model for changing the power state of several VMs.
+
+    Example:
+        {
+            "ext_ids": [
+                "a1b2c3d4-e5f6-7890-abcd-ef1234567890",
+                "b2c3d4e5-f6a7-8901-bcde-f12345678901"
+            ],
+            "action": "SHUTDOWN",
+            "use_batch_api": false
+        }
+    """
+
+    ext_ids: list[str]
+    action: PowerAction
+    use_batch_api: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
+class VmPowerActionResult:
+    """
+    Response model for the outcome of a power action on one VM of a bulk request.
+
+    `power_state` is the state read after all actions were submitted, None if
+    the VM wasn't found. `error` is set if the action failed.
+    """
+
+    ext_id: str
+    power_state: None | str
+    error: None | str = None
+
+
 @dataclasses.dataclass(frozen=True)
 class VmPowerStateResponse:
     """
@@ -757,3 +1394,11 @@ class VmPowerStateResponse:
     ext_id: str
     name: str
     power_state: str
+
+    @classmethod
+    def from_nutanix_vm(cls, vm: vmm.AhvConfigVm) -> Self:
+        return cls(
+            ext_id=cast(str, vm.ext_id),
+            name=cast(str, vm.name),
+            power_state=str(vm.power_state) if vm.power_state else "UNDETERMINED",
+        )
@@ -0,0 +1,95 @@
+"""
+The `/metrics` endpoint, and the metrics without the `metrics` extra.
+"""
+
+import importlib.util
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from nutanix_shim_server import metrics
+from nutanix_shim_server.routes.metrics import record_request
+from nutanix_shim_server.routes.metrics import router as metrics_router
+
+parser = pytest.importorskip("prometheus_client.parser")
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.middleware("http")(record_request)
+    app.include_router(metrics_router)
+
+    @app.get("/vms/{vm_id}")
+    def get_vm(vm_id: str):
+        with metrics.upstream_call("GET /api/vmm/v4.0/ahv/config/vms/{extId}"):
+            metrics.count_retries(2)
+        return {"ext_id": vm_id}
+
+    return TestClient(app)
+
+
+def samples(client: TestClient) -> dict[str, list]:
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == metrics.CONTENT_TYPE
+    families = parser.text_string_to_metric_families(resp.text)
+    return {family.name: family.samples for family in families}
+
+
+def test_metrics_parse(client: TestClient):
+    client.get("/vms/a1b2")
+    client.get("/vms/c3d4")
+    families = samples(client)
+
+    assert {
+        "nutanix_shim_request_duration_seconds",
+        "nutanix_shim_requests_in_flight",
+        "nutanix_shim_upstream_duration_seconds",
+        "nutanix_shim_upstream_retries",
+        "nutanix_shim_bulkhead_wait_duration_seconds",
+    } <= set(families)
+
+    requests = [
+        sample
+        for sample in families["nutanix_shim_request_duration_seconds"]
+        if sample.name.endswith("_count") and sample.labels["route"] == "/vms/{vm_id}"
+    ]
+    assert [(s.labels["method"], s.labels["status"]) for s in requests] == [
+        ("GET", "200")
+    ]
+    assert requests[0].value >= 2
+
+    retries = [
+        sample
+        for sample in families["nutanix_shim_upstream_retries"]
+        if sample.name == "nutanix_shim_upstream_retries_total"
+    ]
+    assert retries[0].labels == {
+        "operation": "GET /api/vmm/v4.0/ahv/config/vms/{extId}"
+    }
+    assert retries[0].value >= 4
+
+
+def test_label_values_are_escaped(client: TestClient):
+    metrics.CACHE_LOOKUPS.labels('quoted "vms"\\\n', "hit").inc()
+    lookups = samples(client)["nutanix_shim_cache_lookups"]
+    assert any(s.labels["resource"] == 'quoted "vms"\\\n' for s in lookups)
+
+
+def test_without_prometheus_client(monkeypatch: pytest.MonkeyPatch):
+    # A separate copy of the module, as if the extra were not installed
+    monkeypatch.setitem(sys.modules, "prometheus_client", None)
+    spec = importlib.util.find_spec("nutanix_shim_server.metrics")
+    assert spec is not None and spec.loader is not None
+    no_op = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(no_op)
+
+    assert not no_op.ENABLED
+    assert no_op.render() == b""
+    with no_op.upstream_call("GET /api/vmm/v4.0/ahv/config/vms"):
+        no_op.count_retries(1)
+    with no_op.REQUESTS_IN_FLIGHT.labels("GET").track_inprogress():
+        no_op.BULKHEAD_WAIT_SECONDS.labels("listing").observe(0.1)
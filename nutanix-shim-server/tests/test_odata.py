@@ -0,0 +1,42 @@
+"""
+OData `$select` projections built from the response models.
+"""
+
+import dataclasses
+
+import ntnx_clustermgmt_py_client as cm
+
+from nutanix_shim_server.clustermgmt import HostCapacity
+from nutanix_shim_server.utils import odata_select
+
+
+@dataclasses.dataclass
+class Model:
+    ext_id: str
+    mac_address: str
+    ip_addresses: list[str]
+    source: str
+
+
+def test_odata_select():
+    assert odata_select(Model) == "extId,macAddress,ipAddresses,source"
+    assert (
+        odata_select(
+            Model,
+            mac_address="nics",
+            ip_addresses=("nics", "guestTools"),
+            source=None,
+        )
+        == "extId,nics,guestTools"
+    )
+
+
+def test_host_capacity_selects_host_properties():
+    properties = HostCapacity.select().split(",")
+    assert set(properties) <= set(cm.Host.attribute_map.values())
+    assert set(properties) == {
+        "cpuCapacityHz",
+        "cpuFrequencyHz",
+        "numberOfCpuCores",
+        "memorySizeBytes",
+    }
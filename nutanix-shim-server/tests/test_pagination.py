@@ -0,0 +1,126 @@
+"""
+Pagination of the list routes with `limit` and `cursor`.
+
+The cursor of a page is made by `set_page_headers` and read back by the
+`page_request` dependency, so these tests walk listings the way a client
+does, following `X-Next-Cursor` until it is left out.
+"""
+
+import types
+
+import pytest
+from fastapi import HTTPException, Response
+
+from nutanix_shim_server.responses import (
+    MAX_PAGE_LIMIT,
+    PageRequest,
+    page_request,
+    set_page_headers,
+)
+from nutanix_shim_server.utils import ListPage, fetch_page
+
+ITEMS = list(range(45))
+
+
+def next_cursor(page: ListPage) -> None | str:
+    response = Response()
+    set_page_headers(response, page)
+    return response.headers.get("X-Next-Cursor")
+
+
+def list_items(_page: int, _limit: int):
+    """Fake Nutanix `list_*` method, over `ITEMS`"""
+    data = ITEMS[_page * _limit : (_page + 1) * _limit]
+    metadata = types.SimpleNamespace(total_available_results=len(ITEMS))
+    return types.SimpleNamespace(data=data, metadata=metadata)
+
+
+def upstream_page(page: PageRequest) -> ListPage:
+    return fetch_page(list_items, page.offset, page.limit)
+
+
+def cached_page(page: PageRequest) -> ListPage:
+    return ListPage.of(ITEMS, page.offset, page.limit)
+
+
+def walk(fetch, limit: None | int, next_limit: None | int = None) -> list[int]:
+    """Items of all pages, asking for the first with `limit`"""
+    items = []
+    page = page_request(limit=limit, cursor=None)
+    while page is not None:
+        list_page = fetch(page)
+        items.extend(list_page.items)
+        cursor = next_cursor(list_page)
+        page = page_request(limit=next_limit, cursor=cursor) if cursor else None
+    return items
+
+
+@pytest.mark.parametrize("limit", [1, 7, 20, 45, MAX_PAGE_LIMIT])
+@pytest.mark.parametrize("next_limit", ["same", None])
+def test_walk_upstream_pages(limit, next_limit):
+    next_limit = limit if next_limit == "same" else None
+    assert walk(upstream_page, limit, next_limit) == ITEMS
+
+
+@pytest.mark.parametrize("limit", [1, 7, 20, 45, MAX_PAGE_LIMIT])
+def test_walk_cached_pages(limit):
+    assert walk(cached_page, limit) == ITEMS
+
+
+def test_cursor_round_trip():
+    cursor = next_cursor(ListPage(items=ITEMS[:20], offset=0, limit=20, total=45))
+    assert page_request(limit=None, cursor=cursor) == PageRequest(offset=20, limit=20)
+    assert page_request(limit=20, cursor=cursor) == PageRequest(offset=20, limit=20)
+
+
+def test_no_page():
+    assert page_request(limit=None, cursor=None) is None
+    assert page_request(limit=10, cursor=None) == PageRequest(offset=0, limit=10)
+
+
+def test_changed_limit_is_rejected():
+    cursor = next_cursor(ListPage(items=ITEMS[:20], offset=0, limit=20, total=45))
+    with pytest.raises(HTTPException) as e:
+        page_request(limit=50, cursor=cursor)
+    assert e.value.status_code == 400
+    assert "pages of 20" in e.value.detail
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        "b2Zmc2V0OjIw",  # offset:20, without a limit
+        "b2Zmc2V0Oi0yMDoyMA",  # offset:-20:20
+        "b2Zmc2V0OjIwOjA",  # offset:20:0
+        "b2Zmc2V0OjIwOjEwMDA",  # offset:20:1000
+        "cGFnZToyMDoyMA",  # page:20:20
+        "b2Zmc2V0OmFiYzoyMA",  # offset:abc:20
+    ],
+)
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as e:
+        page_request(limit=None, cursor=cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "page, next_offset",
+    [
+        (ListPage(items=[1, 2], offset=0, limit=2, total=5), 2),
+        (ListPage(items=[5], offset=4, limit=2, total=5), None),
+        (ListPage(items=[3, 4], offset=2, limit=2, total=4), None),
+        (ListPage(items=[], offset=10, limit=2, total=5), None),
+        (ListPage(items=[1, 2], offset=0, limit=2, total=None), 2),
+        (ListPage(items=[1], offset=2, limit=2, total=None), None),
+        (ListPage(items=[], offset=0, limit=2, total=None), None),
+    ],
+)
+def test_next_offset(page: ListPage, next_offset: None | int):
+    assert page.next_offset == next_offset
+
+
+def test_page_of():
+    page = ListPage.of(ITEMS, 40, 20)
+    assert page == ListPage(items=ITEMS[40:], offset=40, limit=20, total=45)
+    assert page.next_offset is None
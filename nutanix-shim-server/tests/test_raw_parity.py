@@ -0,0 +1,222 @@
+"""
+Parity of the raw JSON converters with the SDK based ones.
+
+With `NUTANIX_RAW_JSON` enabled, listings are converted from the JSON bodies
+by the `from_json` classmethods instead of from SDK models by the
+`from_nutanix_*` ones. Both must produce the same response models, so each
+test builds SDK objects, serializes them to the JSON Nutanix sends, and
+compares the two conversions.
+"""
+
+import datetime
+import json
+
+import ntnx_networking_py_client as net
+import ntnx_vmm_py_client as vmm
+import pytest
+from ntnx_vmm_py_client.models.common.v1.config.IPv4Address import IPv4Address
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.ADSFVolumeGroupReference import (
+    ADSFVolumeGroupReference,
+)
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.ClusterReference import (
+    ClusterReference,
+)
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.Disk import Disk
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.EmulatedNic import EmulatedNic
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.Ipv4Config import Ipv4Config
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.Nic import Nic
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.NicNetworkInfo import (
+    NicNetworkInfo,
+)
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.Vm import Vm
+from ntnx_vmm_py_client.models.vmm.v4.ahv.config.VmDisk import VmDisk
+
+from nutanix_shim_server.networking import SubnetMetadata
+from nutanix_shim_server.vmm import ImageMetadata, VmListMetadata
+
+CREATE_TIME = datetime.datetime(2025, 1, 2, 3, 4, 5, 678000, datetime.timezone.utc)
+UPDATE_TIME = datetime.datetime(
+    2025, 2, 3, 4, 5, 6, tzinfo=datetime.timezone(datetime.timedelta(hours=2))
+)
+
+
+def to_json(obj):
+    """
+    Serialize an SDK object like Nutanix does in its responses.
+
+    Follows the SDK's own serialization of request bodies, from the
+    `attribute_map` of each model, with the UTC datetimes ending in "Z".
+    """
+    if isinstance(obj, list):
+        return [to_json(item) for item in obj]
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat().replace("+00:00", "Z")
+    if hasattr(obj, "attribute_map"):
+        return {
+            obj.attribute_map[attr]: to_json(value)
+            for attr in obj.swagger_types
+            if (value := getattr(obj, attr)) is not None
+        }
+    return obj
+
+
+def payload(obj) -> dict:
+    """`obj` as found in the `data` of a list response"""
+    return json.loads(json.dumps(to_json(obj)))
+
+
+def selected(select: str) -> set[str]:
+    """Top level properties of a `$select` projection"""
+    return {path.split("/")[0] for path in select.split(",")}
+
+
+def nic(mac_address=None, ip_address=None) -> Nic:
+    network_info = None
+    if ip_address is not None:
+        network_info = NicNetworkInfo(
+            ipv4_config=Ipv4Config(ip_address=IPv4Address(value=ip_address))
+        )
+    return Nic(
+        backing_info=EmulatedNic(mac_address=mac_address),
+        network_info=network_info,
+    )
+
+
+def full_vm() -> Vm:
+    """VM with every property `VmListMetadata.select()` projects"""
+    return Vm(
+        ext_id="a1b2c3d4-e5f6-7890-abcd-000000000001",
+        name="web-01",
+        description="Web server",
+        cluster=ClusterReference(ext_id="00061663-9fa0-28ca-185b-ac1f6b6f97e2"),
+        power_state="ON",
+        num_sockets=2,
+        num_cores_per_socket=4,
+        memory_size_bytes=8589934592,
+        create_time=CREATE_TIME,
+        nics=[
+            nic("50:6b:8d:12:34:56", "192.168.1.100"),
+            nic("50:6b:8d:12:34:57", "192.168.1.101"),
+        ],
+        disks=[
+            Disk(backing_info=VmDisk(disk_size_bytes=107374182400)),
+            Disk(backing_info=VmDisk(disk_size_bytes=1073741824)),
+        ],
+    )
+
+
+VMS = {
+    "full": full_vm(),
+    "minimal": Vm(ext_id="a1b2c3d4-e5f6-7890-abcd-000000000002", name="bare"),
+    "nic without ip": Vm(
+        ext_id="a1b2c3d4-e5f6-7890-abcd-000000000003",
+        name="no-ip",
+        power_state="OFF",
+        nics=[nic("50:6b:8d:12:34:58")],
+    ),
+    "volume group disk": Vm(
+        ext_id="a1b2c3d4-e5f6-7890-abcd-000000000004",
+        name="vg",
+        disks=[
+            Disk(
+                backing_info=ADSFVolumeGroupReference(
+                    volume_group_ext_id="b1b2c3d4-e5f6-7890-abcd-000000000001"
+                )
+            )
+        ],
+    ),
+}
+
+
+def test_vm_payload_has_selected_properties():
+    assert selected(VmListMetadata.select()) <= set(payload(full_vm()))
+
+
+@pytest.mark.parametrize("vm", VMS.values(), ids=VMS.keys())
+def test_vm_parity(vm: Vm):
+    assert VmListMetadata.from_json(payload(vm)) == VmListMetadata.from_nutanix_vm(vm)
+
+
+def full_image() -> vmm.Image:
+    """Image with every property `ImageMetadata.select()` projects"""
+    return vmm.Image(
+        ext_id="c1b2c3d4-e5f6-7890-abcd-000000000001",
+        name="ubuntu-24.04",
+        description="Ubuntu cloud image",
+        type="DISK_IMAGE",
+        create_time=CREATE_TIME,
+        last_update_time=UPDATE_TIME,
+        cluster_location_ext_ids=["00061663-9fa0-28ca-185b-ac1f6b6f97e2"],
+        owner_ext_id="d1b2c3d4-e5f6-7890-abcd-000000000001",
+        tenant_id="e1b2c3d4-e5f6-7890-abcd-000000000001",
+        size_bytes=3758096384,
+    )
+
+
+IMAGES = {
+    "full": full_image(),
+    "iso": vmm.Image(
+        ext_id="c1b2c3d4-e5f6-7890-abcd-000000000002",
+        name="installer.iso",
+        type="ISO_IMAGE",
+        create_time=CREATE_TIME,
+        last_update_time=CREATE_TIME,
+        cluster_location_ext_ids=[],
+        owner_ext_id="d1b2c3d4-e5f6-7890-abcd-000000000001",
+        size_bytes=1048576,
+    ),
+}
+
+
+def test_image_payload_has_selected_properties():
+    assert selected(ImageMetadata.select()) <= set(payload(full_image()))
+
+
+@pytest.mark.parametrize("image", IMAGES.values(), ids=IMAGES.keys())
+def test_image_parity(image: vmm.Image):
+    assert ImageMetadata.from_json(payload(image)) == (
+        ImageMetadata.from_nutanix_image(image)
+    )
+
+
+def ipv4(value: str) -> net.IPv4Address:
+    return net.IPv4Address(value=value)
+
+
+SUBNETS = {
+    "vlan": net.Subnet(
+        ext_id="f1b2c3d4-e5f6-7890-abcd-000000000001",
+        name="vlan-100",
+        description="Production",
+        subnet_type="VLAN",
+        network_id=100,
+        cluster_name="cluster-01",
+        cluster_reference="00061663-9fa0-28ca-185b-ac1f6b6f97e2",
+        ip_config=[
+            net.IPConfig(
+                ipv4=net.IPv4Config(
+                    ip_subnet=net.IPv4Subnet(ip=ipv4("10.0.0.0"), prefix_length=24),
+                    default_gateway_ip=ipv4("10.0.0.1"),
+                    dhcp_server_address=ipv4("10.0.0.2"),
+                )
+            )
+        ],
+        is_nat_enabled=False,
+        is_external=True,
+    ),
+    "overlay": net.Subnet(
+        ext_id="f1b2c3d4-e5f6-7890-abcd-000000000002",
+        name="overlay",
+        subnet_type="OVERLAY",
+        vpc_reference="a9b2c3d4-e5f6-7890-abcd-000000000001",
+        is_nat_enabled=True,
+    ),
+    "minimal": net.Subnet(ext_id="f1b2c3d4-e5f6-7890-abcd-000000000003", name="bare"),
+}
+
+
+@pytest.mark.parametrize("subnet", SUBNETS.values(), ids=SUBNETS.keys())
+def test_subnet_parity(subnet: net.Subnet):
+    assert SubnetMetadata.from_json(payload(subnet)) == (
+        SubnetMetadata.from_nutanix_subnet(subnet)
+    )
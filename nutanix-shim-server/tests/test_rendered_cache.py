@@ -0,0 +1,113 @@
+"""
+Cached list responses, encoded once by the `RenderedCache`.
+"""
+
+import gzip
+import time
+import types
+
+import pytest
+from fastapi import Depends, FastAPI, Query, Request
+from fastapi.testclient import TestClient
+
+from nutanix_shim_server.cache import Cached
+from nutanix_shim_server.responses import (
+    PageRequest,
+    RenderedCache,
+    _accepts_gzip,
+    cached_response,
+    page_request,
+)
+
+ITEMS = [{"name": f"vm-{i:04}", "description": "x" * 40} for i in range(200)]
+
+
+def rendered_cache(max_entries: int = 256, max_bytes: int = 2**20) -> RenderedCache:
+    ctx = types.SimpleNamespace(
+        nutanix_response_gzip=True,
+        nutanix_cache_max_entries=max_entries,
+        nutanix_response_cache_max_bytes=max_bytes,
+    )
+    return RenderedCache(ctx)  # type: ignore
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.state.rendered = rendered_cache()
+    cached = Cached(value=ITEMS, fetched_at=time.time())
+
+    @app.get("/items")
+    def list_items(
+        request: Request,
+        name: None | str = Query(None),
+        page: None | PageRequest = Depends(page_request),
+    ):
+        return cached_response(request, cached, page)
+
+    return TestClient(app)
+
+
+def test_undeclared_params_share_an_entry(client: TestClient):
+    rendered: RenderedCache = client.app.state.rendered  # type: ignore
+    for params in [{}, {"_": "1"}, {"_": "2"}, {"other": "x"}]:
+        assert client.get("/items", params=params).json() == ITEMS
+    assert len(rendered._entries) == 1
+
+
+def test_declared_params_have_their_own_entry(client: TestClient):
+    rendered: RenderedCache = client.app.state.rendered  # type: ignore
+    for params in [{}, {"name": "a"}, {"limit": "10"}, {"limit": "10", "_": "1"}]:
+        assert client.get("/items", params=params).status_code == 200
+    assert len(rendered._entries) == 3
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, gzipped",
+    [
+        ("gzip", True),
+        ("gzip, deflate, br", True),
+        ("br;q=1.0, gzip;q=0.8", True),
+        ("*", True),
+        ("gzip;q=0", False),
+        ("gzip; q=0.000", False),
+        ("identity", False),
+        ("*;q=0", False),
+        ("gzip;q=0, *", False),
+        ("*, gzip;q=0", False),
+        ("", False),
+    ],
+)
+def test_gzip_negotiation(client: TestClient, accept_encoding: str, gzipped: bool):
+    resp = client.get("/items", headers={"Accept-Encoding": accept_encoding})
+    assert resp.json() == ITEMS
+    assert (resp.headers.get("Content-Encoding") == "gzip") == gzipped
+    assert _accepts_gzip(accept_encoding) == gzipped
+
+
+def test_bytes_are_capped():
+    renderer = rendered_cache(max_bytes=20_000)
+    cached = Cached(value=ITEMS[:100], fetched_at=time.time())
+    for i in range(5):
+        rendered = renderer.get(f"key-{i}", cached)
+        renderer.gzipped(f"key-{i}", rendered)
+        assert renderer.size <= renderer.max_bytes
+    assert list(renderer._entries) == ["key-3", "key-4"]
+    assert renderer.size == sum(r.size for r in renderer._entries.values())
+    assert gzip.decompress(renderer._entries["key-4"].gzipped or b"") == rendered.body
+
+
+def test_oversized_body_is_not_kept():
+    renderer = rendered_cache(max_bytes=1_000)
+    rendered = renderer.get("key", Cached(value=ITEMS, fetched_at=time.time()))
+    renderer.gzipped("key", rendered)
+    assert rendered.body and not renderer._entries
+    assert renderer.size == 0
+
+
+def test_refetched_value_replaces_its_entry():
+    renderer = rendered_cache()
+    renderer.get("key", Cached(value=ITEMS, fetched_at=1.0))
+    rendered = renderer.get("key", Cached(value=ITEMS[:1], fetched_at=2.0))
+    assert list(renderer._entries.values()) == [rendered]
+    assert renderer.size == rendered.size